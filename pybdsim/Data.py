@@ -16,45 +16,343 @@ Data - read various output files
 import numpy as _np
 from . import Constants as _Constants
 from . import _General
+import ast as _ast
+import collections as _collections
+import bz2 as _bz2
+import functools as _functools
+import glob as _glob
+import gzip as _gzip
+import hashlib as _hashlib
+import itertools as _itertools
+import json as _json
+import multiprocessing as _multiprocessing
 import os as _os
+import struct as _struct
+import sys as _sys
+import threading as _threading
+import warnings as _warnings
+try:
+    import queue as _queue
+except ImportError:
+    import Queue as _queue # python 2
 
 useRootNumpy = True
 
+try:
+    import lzma as _lzma
+except ImportError:
+    _lzma = None # python 2 without backports - xz files can't be read
+
 try:
     import root_numpy as _rnp
 except ImportError:
     useRootNumpy = False
     pass
 
-def Load(filepath):
-    extension = filepath.split('.')[-1]
+def Load(filepath, cache=None, columns=None):
+    """
+    Load a BDSIM output file - ascii (.txt, .dat, eloss and histogram
+    files) or ROOT optics. Ascii files may be compressed with gzip, bzip2
+    or xz (e.g. 'output.txt.gz') and are decompressed as they are read.
+    Files written by BDSAsciiData.Save are opened as memory maps.
+
+    cache   - for text files, reuse a binary sidecar of a previous load
+              instead of parsing the text again (see EnableCache). The
+              default of None uses the module setting.
+    columns - for ROOT files, a list of the branches to read. The default
+              of None reads all of them.
+    """
     if not _os.path.isfile(filepath):
         raise IOError("File does not exist")
-    if ("elosshist" in filepath) or (".hist" in filepath):
-        return _LoadAsciiHistogram(filepath)
-    elif "eloss" in filepath:
-        return _LoadAscii(filepath)
+    if _IsColumnar(filepath):
+        return _ReadColumnar(filepath)
+    name      = _UncompressedName(filepath)
+    extension = name.split('.')[-1]
+    if ("elosshist" in name) or (".hist" in name):
+        loader = _LoadAsciiHistogram
+    elif "eloss" in name:
+        loader = _LoadAscii
     elif extension == 'txt':
-        return _LoadAscii(filepath)
+        loader = _LoadAscii
     elif extension == 'root':
         try:
-            return _LoadRoot(filepath)
+            return _LoadRoot(filepath, columns)
         except NameError:
             #raise error rather than return None, saves later scripting errors.
             raise IOError('Root loader not available.')
     elif extension == 'dat':
-        print('.dat file - trying general loader')
-        try:
-            return _LoadAscii(filepath)
-        except:
-            print("Didn't work")
-            raise IOError("Unknown file type - not BDSIM data")
+        loader = _LoadDat
+    else:
+        raise IOError("Unknown file type - not BDSIM data")
+
+    if cache is None:
+        cache = _cache['enabled']
+    if cache:
+        return _LoadCached(filepath, loader)
+    else:
+        return loader(filepath)
+
+def LoadMany(paths, workers=1, sourcecolumn=None):
+    """
+    Load many BDSIM ascii files with the same columns, e.g. the output of
+    the jobs of a batch of runs, and merge them into one BDSAsciiData
+    instance with the rows of each file in turn.
+
+    paths        - list of file paths or a glob pattern such as "run*/output.txt".
+    workers      - number of processes to parse the files in. The files are
+                   passed back one at a time as they finish.
+    sourcecolumn - if given, the name of an extra column holding the index
+                   of the file each row came from. The list of files is
+                   kept as the 'sources' attribute of the result.
+
+    All files must have the same column names and units.
+    """
+    if isinstance(paths, str):
+        pattern = paths
+        paths   = sorted(_glob.glob(pattern))
+        if len(paths) == 0:
+            raise IOError("No files match "+pattern)
+    paths = list(paths)
+    if len(paths) == 0:
+        raise IOError("No files to load")
+
+    if workers > 1 and len(paths) > 1:
+        pool    = _multiprocessing.Pool(min(workers, len(paths)))
+        results = pool.imap(_LoadColumns, paths)
+    else:
+        pool    = None
+        results = (_LoadColumns(path) for path in paths)
+
+    try:
+        names, units, parts, sources = None, None, None, []
+        for i,(fnames,funits,columns) in enumerate(results):
+            if names is None:
+                names, units = fnames, funits
+                parts = [[] for name in names]
+            elif fnames != names or funits != units:
+                raise ValueError("Columns of "+paths[i]+" don't match those of "+paths[0])
+            for part,column in zip(parts,columns):
+                part.append(column)
+            if sourcecolumn is not None:
+                sources.append(_np.full(len(columns[0]) if len(columns) > 0 else 0, i, dtype=int))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    columns = [_JoinBlocks(part) for part in parts]
+    if sourcecolumn is not None:
+        names   = names + [sourcecolumn]
+        units   = units + ['NA']
+        columns = columns + [_np.concatenate(sources)]
+    data = _BuildFromColumns(names, units, columns)
+    data.sources = paths
+    return data
+
+def Inspect(filepath, samplesize=65536):
+    """
+    Describe a BDSIM output file by reading only its header and the start
+    of its data. Returns a dictionary with:
+
+    'names' - list of column names (None if they can't be read)
+    'units' - list of column units
+    'nrows' - number of rows - exact for small files, otherwise estimated
+              from the length of the first rows (None if unknown, which
+              is always the case for large compressed files)
+    'kind'  - one of 'root', 'columnar', 'histogram', 'eloss', 'survey',
+              'optics' or 'ascii'
+    """
+    if not _os.path.isfile(filepath):
+        raise IOError("File does not exist")
+    info = {'names' : None, 'units' : None, 'nrows' : None, 'kind' : 'ascii'}
+
+    if filepath.split('.')[-1] == 'root':
+        info['kind'] = 'root'
+        if useRootNumpy:
+            trees = _rnp.list_trees(filepath)
+            for tree in ['optics', 'orbit']:
+                if tree in trees:
+                    info['names'] = list(_rnp.list_branches(filepath, tree))
+                    info['units'] = ['NA']*len(info['names'])
+                    break
+        return info
+
+    if _IsColumnar(filepath):
+        header = _ReadColumnarHeader(filepath)
+        info.update({'names' : [str(n) for n in header['names']],
+                     'units' : [str(u) for u in header['units']],
+                     'nrows' : header['nrows'],
+                     'kind'  : 'columnar'})
+        return info
+
+    compressed = _Compression(filepath) is not None
+    name = _UncompressedName(filepath)
+    f = _Open(filepath)
+    f.readline()
+    header = f.readline()
+    if ("elosshist" in name) or (".hist" in name):
+        # under and overflow lines between the header and the data
+        f.readline()
+        f.readline()
+    datastart = 0 if compressed else f.tell()
+    sample = f.read(samplesize)
+    complete = len(f.read(1)) == 0
+    f.close()
+
+    info['names'], info['units'] = _ParseHeaderLine(header)
+    lines = [line for line in sample.splitlines() if not line.startswith('#')]
+    if complete:
+        info['nrows'] = len(lines)
+    elif len(lines) > 1 and not compressed:
+        # the last line of the sample is probably cut short
+        datasize = _os.path.getsize(filepath) - datastart
+        info['nrows'] = int(round(datasize * float(len(lines)-1) / len(sample[:sample.rfind('\n')+1])))
+
+    names = info['names']
+    if ("elosshist" in name) or (".hist" in name):
+        info['kind'] = 'histogram'
+    elif "eloss" in name:
+        info['kind'] = 'eloss'
+    elif 'SStart' in names:
+        info['kind'] = 'survey'
+    elif len(set(names).intersection(['Beta_x','Sigma_x','Emitt_x','Disp_x'])) > 0:
+        info['kind'] = 'optics'
+    return info
+
+memoizedMaxEntries = 8  # number of tables kept by LoadMemoized
+_memoized = _collections.OrderedDict()
+
+def LoadMemoized(filepath):
+    """
+    Load a file as Load does but keep the result so loading the same
+    unchanged file again (same path, size and modification time) doesn't
+    read it again. The memoizedMaxEntries most recently used tables are
+    kept for the lifetime of the process.
+
+    Each call returns a separate BDSAsciiData instance that shares the
+    column arrays of the kept one, so it may be modified without
+    affecting later calls.
+    """
+    stat = _os.stat(filepath)
+    key  = (_os.path.abspath(filepath), stat.st_size, stat.st_mtime)
+    if key in _memoized:
+        data = _memoized.pop(key)
+    else:
+        data = Load(filepath)
+    _memoized[key] = data  # (re)insert as the most recently used
+    while len(_memoized) > max(memoizedMaxEntries, 0):
+        _memoized.popitem(last=False)
+    return data._ShallowCopy()
+
+def ClearMemoized():
+    """
+    Forget all of the tables kept by LoadMemoized.
+    """
+    _memoized.clear()
+
+def Join(left, right, on="Name", how="inner", suffix="_right"):
+    """
+    Join two tables row by row, e.g. a loss table with a survey or optics.
+    left and right are BDSAsciiData instances or paths of files to load.
+
+    on     - "Name": match rows with the same 'Name'. If a name appears
+             more than once in right, the first row is used.
+             "S": match each row of left by its 'S' (or 'SStart') position
+             to the element of right containing it (right needs 'SStart'
+             and 'Arc_len' or 'SEnd' - see BDSAsciiData.IndicesFromS).
+    how    - "inner" keeps only the rows of left that have a match,
+             "left" keeps all of them with NaN (or '') for the missing values.
+    suffix - added to the names of columns of right that are also in left.
+
+    Returns a new BDSAsciiData instance with the columns of left followed by
+    the columns of right (except the "Name" key column for name joins).
+    """
+    if isinstance(left, str):
+        left = Load(left)
+    if isinstance(right, str):
+        right = Load(right)
+    if how not in ("inner", "left"):
+        raise ValueError("how must be 'inner' or 'left'")
+
+    if on == "Name":
+        if "Name" not in left.names or "Name" not in right.names:
+            raise ValueError("Both tables need a Name column to join on Name")
+        index   = right._NameIndex()
+        inds    = _np.array([index.get(n, -1) for n in left._GetColumnView("Name").tolist()], dtype=int)
+        skipped = ["Name"]
+    elif on == "S":
+        scolumn = "S" if "S" in left.names else "SStart"
+        if scolumn not in left.names:
+            raise ValueError("The left table needs an S or SStart column to join on S")
+        inds    = _np.asarray(right.IndicesFromS(left._GetColumnView(scolumn), outside='flag'))
+        skipped = []
     else:
+        raise ValueError("on must be 'Name' or 'S'")
+
+    matched = inds >= 0
+    if how == "inner" and not _np.all(matched):
+        left = left._View(matched)
+        inds = inds[matched]
+        matched = _np.ones(len(inds), dtype=bool)
+
+    names   = list(left.names)
+    units   = list(left.units)
+    columns = [left._GetColumnView(n) for n in left.names]
+    safe    = _np.where(matched, inds, 0)
+    for name,unit in zip(right.names,right.units):
+        if name in skipped:
+            continue
+        column = right._GetColumnView(name)
+        if len(column) == 0:
+            column = _np.full(len(inds), _np.nan)
+        else:
+            column = column[safe]
+        if not _np.all(matched):
+            if column.dtype.kind in 'US':
+                column[~matched] = ''
+            else:
+                column = column.astype(float)
+                column[~matched] = _np.nan
+        names.append(name + suffix if name in left.names else name)
+        units.append(unit)
+        columns.append(column)
+    return _BuildFromColumns(names, units, columns)
+
+def _LoadDat(filepath):
+    print('.dat file - trying general loader')
+    try:
+        return _LoadAscii(filepath)
+    except:
+        print("Didn't work")
         raise IOError("Unknown file type - not BDSIM data")
 
 def _LoadAscii(filepath):
+    """
+    Load a BDSIM ascii file. The header is read once and the rest of the
+    file is parsed in large blocks straight into one array per column.
+    Files that don't have the regular layout are loaded line by line.
+    """
+    f = _Open(filepath)
+    first  = f.readline()
+    header = f.readline()
+    if not first.startswith('#') or header.startswith('#') or not header.strip():
+        # anything unusual before the data - use the general loader
+        f.close()
+        return _LoadAsciiLines(filepath)
+    names,units = _ParseHeaderLine(header)
+    columns = _ParseColumns(_ReadBlocks(f), len(names))
+    f.close()
+    if columns is None:
+        return _LoadAsciiLines(filepath)
+    return _BuildFromColumns(names, units, columns)
+
+def _LoadAsciiLines(filepath):
+    """
+    Line by line ascii loader - used for files that the bulk parser
+    can't handle.
+    """
     data = BDSAsciiData()
-    f = open(filepath, 'r')
+    f = _Open(filepath)
     for i, line in enumerate(f):
         if line.startswith("#"):
             pass
@@ -71,44 +369,634 @@ def _LoadAscii(filepath):
 
 def _LoadAsciiHistogram(filepath):
     data = BDSAsciiData()
-    f = open(filepath,'r')
-    for i, line in enumerate(f):
+    f = _Open(filepath)
+    names,units = [],[]
+    rows = []
+    for i in range(4):
+        line = f.readline()
         # first line is header (0 counting)
         if i == 1:
             names,units = _ParseHeaderLine(line)
-            for name,unit in zip(names,units):
-                data._AddProperty(name,unit)
-        elif "nderflow" in line:
-            data.underflow = float(line.strip().split()[1])
-        elif "verflow" in line:
-            data.overflow  = float(line.strip().split()[1])
-        elif i >= 4:
-            data.append(tuple(map(float,line.split())))
+        else:
+            _ParseHistogramFlow(data, line)
+    columns = _ParseColumns(_ReadBlocks(f, flowdata=data), len(names), numeric=True)
+    f.close()
+    if columns is None:
+        raise ValueError("Histogram file "+filepath+" has rows of unequal length")
+    hist = _BuildFromColumns(names, units, columns)
+    for attr in ['underflow', 'overflow']:
+        if hasattr(data, attr):
+            setattr(hist, attr, getattr(data, attr))
+    return hist
+
+def _ParseHistogramFlow(data, line):
+    """
+    Record an underflow or overflow line of a histogram file in data.
+    Returns True if the line was one of these.
+    """
+    if "nderflow" in line:
+        data.underflow = float(line.strip().split()[1])
+    elif "verflow" in line:
+        data.overflow  = float(line.strip().split()[1])
+    else:
+        return False
+    return True
+
+_BLOCKSIZE = 32*1024*1024 # characters of text parsed at a time by the bulk parser
+
+def _ReadBlocks(f, blocksize=_BLOCKSIZE, flowdata=None):
+    """
+    Yield blocks of whole lines from an open file with comment lines
+    removed. If flowdata is given, histogram underflow / overflow lines
+    are also removed and recorded in it.
+
+    The file is read (and decompressed) by a background thread one block
+    ahead of the blocks being used.
+    """
+    remainder = ''
+    for chunk in _Prefetch(f, blocksize):
+        block = remainder + chunk
+        cut   = block.rfind('\n') + 1
+        block, remainder = block[:cut], block[cut:]
+        if block:
+            yield _StripBlock(block, flowdata)
+    if remainder:
+        yield _StripBlock(remainder, flowdata)
+
+def _StripBlock(block, flowdata=None):
+    if '#' in block or (flowdata is not None and 'verflow' in block):
+        lines = [line for line in block.splitlines(True) if not line.startswith('#')]
+        if flowdata is not None:
+            lines = [line for line in lines if not _ParseHistogramFlow(flowdata, line)]
+        block = ''.join(lines)
+    return block
+
+def _Prefetch(f, blocksize, depth=2):
+    """
+    Yield blocks of up to blocksize characters read from f by a background
+    thread, so reading and decompressing the next blocks overlaps with the
+    use of this one. zlib, bz2 and lzma release the GIL while decompressing.
+    """
+    blocks = _queue.Queue(depth)
+    stop   = _threading.Event()
+    def Reader():
+        try:
+            while not stop.is_set():
+                block = f.read(blocksize)
+                blocks.put(block)
+                if not block:
+                    break
+        except Exception as e:
+            blocks.put(e)
+    thread = _threading.Thread(target=Reader)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                break
+            yield block
+    finally:
+        # let the reader finish if the blocks aren't all used
+        stop.set()
+        while thread.is_alive():
+            try:
+                blocks.get(timeout=0.1)
+            except _queue.Empty:
+                pass
+        thread.join()
+
+_TEXTMODE = 'rt' if _sys.version_info[0] > 2 else 'rb'
+
+def _OpenGzip(filepath):
+    return _gzip.open(filepath, _TEXTMODE)
+
+def _OpenXz(filepath):
+    if _lzma is None:
+        raise IOError("lzma module not available - can't read xz compressed file "+filepath)
+    return _lzma.open(filepath, _TEXTMODE)
+
+def _OpenBz2(filepath):
+    if hasattr(_bz2, 'open'):
+        return _bz2.open(filepath, _TEXTMODE)
+    return _bz2.BZ2File(filepath, 'rb') # python 2
+
+# magic bytes at the start of the file, opener and usual file extension
+_COMPRESSION = {'gzip'  : (b'\x1f\x8b',         _OpenGzip, 'gz'),
+                'bzip2' : (b'BZh',              _OpenBz2,  'bz2'),
+                'xz'    : (b'\xfd7zXZ\x00',     _OpenXz,   'xz')}
+
+def _Compression(filepath):
+    """
+    Return the compression of a file ('gzip', 'bzip2' or 'xz') from its
+    first bytes, or None if it isn't compressed.
+    """
+    f = open(filepath, 'rb')
+    start = f.read(6)
     f.close()
+    for name,(magic,opener,extension) in _COMPRESSION.items():
+        if start.startswith(magic):
+            return name
+    return None
+
+def _UncompressedName(filepath):
+    """
+    File path without the compression extension, e.g. 'a.txt' for
+    'a.txt.gz', if the file is compressed.
+    """
+    compression = _Compression(filepath)
+    if compression is not None and filepath.endswith('.'+_COMPRESSION[compression][2]):
+        return filepath[:-len(_COMPRESSION[compression][2])-1]
+    return filepath
+
+def _Open(filepath):
+    """
+    Open a text file for reading, decompressing it on the fly if it is
+    compressed with gzip, bzip2 or xz.
+    """
+    compression = _Compression(filepath)
+    if compression is None:
+        return open(filepath, 'r')
+    return _COMPRESSION[compression][1](filepath)
+
+def _ParseColumns(blocks, ncolumns, numeric=None):
+    """
+    Parse blocks of whitespace separated rows into one numpy array per column.
+
+    Columns are taken as numeric if all of the values in the first rows
+    are numbers (or if numeric is True). Blocks of only numeric columns are
+    parsed by numpy's C parser straight into one array. Anything else is
+    split into tokens, with numeric columns converted a whole column at a
+    time and the rest cast value by value like the line by line loader.
+    Returns None if the rows don't all have ncolumns values.
+    """
+    columnblocks = [[] for i in range(ncolumns)]
+    for block in blocks:
+        if not block:
+            continue
+        nrows = block.count('\n') + (0 if block.endswith('\n') else 1)
+        if numeric is None:
+            tokens  = _FirstLines(block, 100).split()
+            numeric = [all(map(_General.IsFloat, tokens[i::ncolumns]))
+                       for i in range(ncolumns)]
+        elif numeric is True:
+            numeric = [True]*ncolumns
+        columns = _ParseBlock(block, nrows, ncolumns, numeric)
+        if columns is None:
+            return None
+        for i,column in enumerate(columns):
+            columnblocks[i].append(column)
+    return [_JoinBlocks(b) for b in columnblocks]
+
+def _FirstLines(block, nlines):
+    """
+    The first nlines lines of a block of text.
+    """
+    end = 0
+    for i in range(nlines):
+        end = block.find('\n', end) + 1
+        if end == 0:
+            return block
+    return block[:end]
+
+def _ParseBlock(block, nrows, ncolumns, numeric):
+    """
+    Parse a block of text of nrows rows into a list of ncolumns arrays, or
+    None if it doesn't have nrows*ncolumns values.
+    """
+    if all(numeric):
+        with _warnings.catch_warnings():
+            # numpy warns (or in future raises) if the text isn't all numbers
+            _warnings.simplefilter('ignore', DeprecationWarning)
+            try:
+                values = _np.fromstring(block, dtype=float, sep=' ')
+            except ValueError:
+                values = None
+        if values is not None and len(values) == nrows*ncolumns:
+            values = values.reshape(nrows, ncolumns)
+            return [values[:,i].copy() for i in range(ncolumns)]
+    else:
+        columns = _ParseMixedBlock(block, nrows, ncolumns, numeric)
+        if columns is not None:
+            return columns
+    tokens = block.split()
+    if len(tokens) != nrows*ncolumns:
+        return None
+    columns = []
+    for i in range(ncolumns):
+        column = None
+        if numeric[i]:
+            try:
+                column = _np.array(tokens[i::ncolumns], dtype=float)
+            except ValueError:
+                pass
+        if column is None:
+            #this tries to cast to float, but if not leaves as string
+            column = _np.array(list(map(_General.Cast, tokens[i::ncolumns])))
+        columns.append(column)
+    return columns
+
+# first characters of the strings float() may accept
+_FLOATSTART = [c.encode('ascii') for c in '0123456789+-.iInN']
+
+def _ParseMixedBlock(block, nrows, ncolumns, numeric):
+    """
+    Parse a block with string columns in one pass of numpy's C parser -
+    the numeric columns as floats and the others as byte strings at most
+    a line long. Returns None if that isn't possible, e.g. for rows of
+    unequal length or non-ascii text, or if a string column has values
+    that are numbers, which _General.Cast would convert.
+    """
+    lines = block.splitlines()
+    if len(lines) != nrows or nrows == 0:
+        return None
+    width = max(map(len, lines))
+    dtype = _np.dtype([('c%d' % i, float if numeric[i] else 'S%d' % width)
+                       for i in range(ncolumns)])
+    try:
+        values = _np.loadtxt(lines, dtype=dtype, comments=None, ndmin=1)
+    except (ValueError, UnicodeError):
+        return None
+    if len(values) != nrows:
+        return None
+    columns = []
+    for i in range(ncolumns):
+        column = values['c%d' % i]
+        if not numeric[i]:
+            maybefloat = _np.isin(column.astype('S1'), _FLOATSTART)
+            if any(map(_General.IsFloat, column[maybefloat].tolist())):
+                return None
+            try:
+                column = column.astype('U%d' % max(1, _np.char.str_len(column).max()))
+            except UnicodeError:
+                return None
+        columns.append(_np.ascontiguousarray(column))
+    return columns
+
+def _JoinBlocks(blocks):
+    """
+    Join the arrays of a column parsed from each block into one array.
+    """
+    blocks = [b for b in blocks if len(b) > 0]
+    if len(blocks) == 0:
+        return _np.array([])
+    elif len(blocks) == 1:
+        return blocks[0]
+    kinds = set([b.dtype.kind for b in blocks])
+    if kinds.issubset(set('biuf')) or kinds.issubset(set('US')):
+        return _np.concatenate(blocks)
+    else:
+        # mixture of numbers and strings (or objects) - same as a column
+        # of python values
+        return _np.array([v for b in blocks for v in b.tolist()])
+
+def _BuildFromColumns(names, units, columns):
+    data = BDSAsciiData()
+    for name,unit in zip(names,units):
+        data._AddProperty(name,unit)
+    for name,column in zip(names,columns):
+        if name not in data._data:
+            data._SetColumn(name,column)
     return data
 
-def _LoadRoot(filepath):
+def Iterate(filepath, chunksize=1000000):
+    """
+    Iterate over a BDSIM ascii file in chunks of at most chunksize rows
+    without loading the whole file. Each chunk is a BDSAsciiData instance
+    with the names and units from the header of the file. For histogram
+    files the underflow and overflow lines are not rows - they are set as
+    the underflow and overflow attributes of every chunk, as Load does.
+
+    >>> for chunk in pybdsim.Data.Iterate("output.eloss.txt"):
+    ...     print(chunk.E().max())
+
+    The Iter* functions reduce these chunks in constant memory, e.g.
+
+    >>> pybdsim.Data.IterSum(pybdsim.Data.Iterate("output.eloss.txt"), "E")
+    """
+    f = _Open(filepath)
+    try:
+        first  = f.readline()
+        header = f.readline()
+        if not first.startswith('#') or header.startswith('#') or not header.strip():
+            raise IOError("Can't find the header of "+filepath+" - use Load instead")
+        names,units = _ParseHeaderLine(header)
+        name     = _UncompressedName(filepath)
+        flowdata = None
+        numeric  = None
+        if ("elosshist" in name) or (".hist" in name):
+            flowdata = BDSAsciiData() # holds the underflow and overflow
+            numeric  = True
+        while True:
+            lines = list(_itertools.islice(f, chunksize))
+            if len(lines) == 0:
+                break
+            block = _StripBlock(''.join(lines), flowdata)
+            if not block:
+                continue
+            columns = _ParseColumns([block], len(names), numeric)
+            if columns is None:
+                # rows of unequal length - cast this chunk line by line
+                chunk = BDSAsciiData()
+                for name,unit in zip(names,units):
+                    chunk._AddProperty(name,unit)
+                chunk.extend([tuple(map(_General.Cast,line.split())) for line in block.splitlines()])
+            else:
+                if numeric is None:
+                    numeric = [c.dtype.kind == 'f' for c in columns]
+                chunk = _BuildFromColumns(names, units, columns)
+            for attr in ['underflow', 'overflow']:
+                if hasattr(flowdata, attr):
+                    setattr(chunk, attr, getattr(flowdata, attr))
+            yield chunk
+    finally:
+        f.close()
+
+def IterCount(chunks):
+    """
+    Number of rows in an iterable of BDSAsciiData chunks (see Iterate).
+    """
+    return sum([len(chunk) for chunk in chunks])
+
+def IterSum(chunks, column):
+    """
+    Sum of column over an iterable of BDSAsciiData chunks (see Iterate).
+    """
+    total = 0.0
+    for chunk in chunks:
+        total += _np.sum(chunk.GetColumn(column))
+    return total
+
+def IterMin(chunks, column):
+    """
+    Minimum of column over an iterable of BDSAsciiData chunks (see Iterate).
+    Returns None if there are no rows.
+    """
+    return IterMinMax(chunks, column)[0]
+
+def IterMax(chunks, column):
+    """
+    Maximum of column over an iterable of BDSAsciiData chunks (see Iterate).
+    Returns None if there are no rows.
+    """
+    return IterMinMax(chunks, column)[1]
+
+def IterMinMax(chunks, column):
+    """
+    (minimum, maximum) of column over an iterable of BDSAsciiData chunks
+    (see Iterate). Returns (None, None) if there are no rows.
+    """
+    vmin, vmax = None, None
+    for chunk in chunks:
+        values = chunk.GetColumn(column)
+        if len(values) == 0:
+            continue
+        cmin, cmax = _np.min(values), _np.max(values)
+        vmin = cmin if vmin is None else min(vmin, cmin)
+        vmax = cmax if vmax is None else max(vmax, cmax)
+    return vmin, vmax
+
+def IterHistogram(chunks, column, bins, range=None, weights=None):
+    """
+    Histogram of column over an iterable of BDSAsciiData chunks (see
+    Iterate). Returns (counts, binedges) as numpy.histogram does.
+
+    bins    - either an array of bin edges or a number of bins, in which
+              case range=(low,high) must be given as the edges have to be
+              fixed before the data is seen.
+    weights - optional name of a column to weight each entry by.
+    """
+    if _np.ndim(bins) == 0:
+        if range is None:
+            raise ValueError("range must be given with a number of bins")
+        edges = _np.linspace(range[0], range[1], int(bins)+1)
+    else:
+        edges = _np.asarray(bins, dtype=float)
+    counts = _np.zeros(len(edges)-1)
+    for chunk in chunks:
+        w = None if weights is None else chunk.GetColumn(weights)
+        counts += _np.histogram(chunk.GetColumn(column), edges, weights=w)[0]
+    return counts, edges
+
+def IterStatistics(chunks, columns, relativeaccuracy=0.01):
+    """
+    Accumulate StreamStatistics of columns over an iterable of
+    BDSAsciiData chunks (see Iterate).
+
+    >>> st = pybdsim.Data.IterStatistics(pybdsim.Data.Iterate("output.txt"),
+    ...                                  ['X','Xp','Y','Yp','E'])
+    >>> st.Std(), st.Covariance(), st.Percentile([5,50,95])
+    """
+    stats = StreamStatistics(columns, relativeaccuracy)
+    for chunk in chunks:
+        stats.Add(chunk)
+    return stats
+
+class StreamStatistics(object):
+    """
+    One-pass statistics of a set of columns for data that doesn't fit in
+    memory - count, min, max, mean, standard deviation, RMS, covariance
+    matrix and approximate quantiles.
+
+    Data is added in chunks with Add() (BDSAsciiData instances or arrays of
+    shape (n, ncolumns)). Instances filled separately, e.g. by parallel
+    workers, can be combined with Merge(). The moments are combined with
+    the pairwise update of Chan et al. and the quantile sketches hold bin
+    counts that simply add, so a merged result is the same as one pass
+    over all of the data (up to floating point rounding of the moments).
+
+    Quantiles use a logarithmically binned sketch: each value is put in a
+    bin of relative width set by relativeaccuracy (default 1%), so a
+    quantile is returned with at most that relative error whatever the
+    range of the data.
+    """
+    def __init__(self, columns, relativeaccuracy=0.01):
+        self.columns = list(columns)
+        self.relativeaccuracy = relativeaccuracy
+        ncolumns     = len(self.columns)
+        self.n       = 0
+        self.mean    = _np.zeros(ncolumns)
+        self.comoment = _np.zeros((ncolumns, ncolumns)) # sum of (x-mean)(x-mean)^T
+        self.min     = _np.full(ncolumns, _np.inf)
+        self.max     = _np.full(ncolumns, -_np.inf)
+        self._gamma  = (1.0 + relativeaccuracy) / (1.0 - relativeaccuracy)
+        # per column: counts of bins of positive and negative values keyed
+        # by bin number, and the number of zeros
+        self._positive = [{} for c in self.columns]
+        self._negative = [{} for c in self.columns]
+        self._zeros    = _np.zeros(ncolumns, dtype=int)
+
+    def Add(self, data):
+        """
+        Add a BDSAsciiData instance (using the named columns) or an array
+        of shape (n, ncolumns) with the columns in the same order.
+        """
+        if isinstance(data, BDSAsciiData):
+            if len(data) == 0:
+                return
+            values = _np.column_stack([data.GetColumn(c) for c in self.columns])
+        else:
+            values = _np.asarray(data, dtype=float).reshape(-1, len(self.columns))
+        n = len(values)
+        if n == 0:
+            return
+        mean     = values.mean(axis=0)
+        centred  = values - mean
+        comoment = _np.dot(centred.T, centred)
+        self._MergeMoments(n, mean, comoment)
+        self.min = _np.minimum(self.min, values.min(axis=0))
+        self.max = _np.maximum(self.max, values.max(axis=0))
+        for i in range(len(self.columns)):
+            self._AddToSketch(i, values[:,i])
+
+    def Merge(self, other):
+        """
+        Add the statistics of another instance with the same columns and
+        relative accuracy to this one.
+        """
+        if other.columns != self.columns or other.relativeaccuracy != self.relativeaccuracy:
+            raise ValueError("Can only merge statistics of the same columns and accuracy")
+        if other.n == 0:
+            return
+        self._MergeMoments(other.n, other.mean, other.comoment)
+        self.min = _np.minimum(self.min, other.min)
+        self.max = _np.maximum(self.max, other.max)
+        for i in range(len(self.columns)):
+            for mine,theirs in [(self._positive[i], other._positive[i]),
+                                (self._negative[i], other._negative[i])]:
+                for key,count in theirs.items():
+                    mine[key] = mine.get(key, 0) + count
+        self._zeros += other._zeros
+
+    def _MergeMoments(self, n, mean, comoment):
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean      = self.mean + delta * (float(n) / total)
+        self.comoment  = self.comoment + comoment + _np.outer(delta, delta) * (float(self.n) * n / total)
+        self.n         = total
+
+    def _AddToSketch(self, i, values):
+        values = values[_np.isfinite(values)]
+        self._zeros[i] += _np.count_nonzero(values == 0)
+        for sketch,part in [(self._positive[i], values[values > 0]),
+                            (self._negative[i], -values[values < 0])]:
+            if len(part) == 0:
+                continue
+            keys = _np.ceil(_np.log(part) / _np.log(self._gamma)).astype(int)
+            keys, counts = _np.unique(keys, return_counts=True)
+            for key,count in zip(keys.tolist(), counts.tolist()):
+                sketch[key] = sketch.get(key, 0) + count
+
+    def Mean(self):
+        return self.mean.copy()
+
+    def Covariance(self, ddof=0):
+        """
+        Covariance matrix of the columns (ddof=1 for the sample covariance).
+        """
+        return self.comoment / (self.n - ddof)
+
+    def Std(self, ddof=0):
+        return _np.sqrt(_np.diag(self.Covariance(ddof)))
+
+    def RMS(self):
+        """
+        Root mean square of each column - about zero, not the mean.
+        """
+        return _np.sqrt(_np.diag(self.Covariance()) + self.mean**2)
+
+    def Quantile(self, q):
+        """
+        Approximate quantile(s) q (0 to 1) of each column. Returns an array
+        of shape (ncolumns,) for a single q or (len(q), ncolumns).
+        """
+        qs = _np.atleast_1d(_np.asarray(q, dtype=float))
+        result = _np.empty((len(qs), len(self.columns)))
+        for i in range(len(self.columns)):
+            # bins in increasing order of value: negatives, zeros, positives
+            negkeys = sorted(self._negative[i].keys(), reverse=True)
+            poskeys = sorted(self._positive[i].keys())
+            centres = [-self._BinValue(k) for k in negkeys] + [0.0] + [self._BinValue(k) for k in poskeys]
+            counts  = ([self._negative[i][k] for k in negkeys] + [self._zeros[i]] +
+                       [self._positive[i][k] for k in poskeys])
+            cumulative = _np.cumsum(counts)
+            if len(cumulative) == 0 or cumulative[-1] == 0:
+                result[:,i] = _np.nan
+                continue
+            ranks = qs * (cumulative[-1] - 1)
+            bins  = _np.searchsorted(cumulative, ranks, side='right')
+            result[:,i] = _np.clip(_np.asarray(centres)[bins], self.min[i], self.max[i])
+        return result[0] if _np.ndim(q) == 0 else result
+
+    def Percentile(self, p):
+        """
+        Approximate percentile(s) p (0 to 100) of each column - see Quantile.
+        """
+        return self.Quantile(_np.asarray(p, dtype=float) / 100.0)
+
+    def _BinValue(self, key):
+        # value in the middle of bin key in terms of relative error
+        return 2.0 * self._gamma**key / (self._gamma + 1.0)
+
+    def __repr__(self):
+        return ('pybdsim.Data.StreamStatistics instance\n' + str(self.n) +
+                ' entries of ' + ', '.join(self.columns))
+
+def _LoadRoot(filepath, columns=None):
     if not useRootNumpy:
         raise IOError("root_numpy not available - can't load ROOT file")
-    data = BDSAsciiData()
     trees = _rnp.list_trees(filepath)
 
     if 'optics' in trees:
-        branches = _rnp.list_branches(filepath,'optics')
-        treedata = _rnp.root2array(filepath,'optics')
+        treename = 'optics'
     elif 'orbit' in trees:
-        branches = _rnp.list_branches(filepath, 'orbit')
-        treedata = _rnp.root2array(filepath, 'orbit')
+        treename = 'orbit'
     else:
         raise IOError("This file doesn't have the required tree 'optics'.")
-    for element in range(len(treedata[branches[0]])):
-        elementlist=[]
-        for branch in branches:
-            if element == 0:
-                data._AddProperty(branch)
-            elementlist.append(treedata[branch][element])
-        data.append(elementlist)
-    return data
+    branches = _rnp.list_branches(filepath, treename)
+    if columns is not None:
+        missing = [c for c in columns if c not in branches]
+        if len(missing) > 0:
+            raise ValueError("Branches "+str(missing)+" are not in the "+treename+" tree")
+        branches = list(columns)
+    treedata = _rnp.root2array(filepath, treename, branches=branches)
+    return _BuildFromStructuredArray(treedata, branches)
+
+def _BuildFromStructuredArray(array, names=None):
+    """
+    Build a BDSAsciiData instance from the fields of a numpy structured
+    array, one column per field, without going through rows.
+    """
+    if names is None:
+        names = list(array.dtype.names)
+    return _BuildFromColumns(names, ['NA']*len(names), [array[name] for name in names])
+
+def _LoadColumns(filepath):
+    """
+    Load a file and return its names, units and columns - the plain
+    lists and arrays LoadMany merges, passed back from worker processes
+    without the rest of the instance.
+    """
+    data = Load(filepath)
+    data._Consolidate()
+    return data.names, data.units, [_np.asarray(data._data[n]) for n in data.names]
+
+def _LoadPaths(paths, workers=1):
+    """
+    Load a list of files, using a pool of worker processes if workers > 1.
+    """
+    if workers > 1 and len(paths) > 1:
+        pool = _multiprocessing.Pool(min(workers, len(paths)))
+        try:
+            return pool.map(Load, paths)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        return [Load(path) for path in paths]
 
 def _ParseHeaderLine(line):
     names = []
@@ -123,27 +1011,691 @@ def _ParseHeaderLine(line):
     return names, units
                 
 
-class BDSAsciiData(list):
+_COLUMNARMAGIC     = b'BDSCOL01'
+_COLUMNARALIGNMENT = 64
+
+def _WriteColumnar(data, filepath, source=None):
+    """
+    Write a BDSAsciiData instance to a binary columnar file.
+
+    The file is the 8 byte magic string, the length of a json header as
+    a little-endian uint64, the json header (names, units, number of rows,
+    dtype and offset of each column, histogram under/overflow and an
+    optional dictionary describing the source file) and then each column
+    as one contiguous block aligned to 64 bytes.
+    """
+    data._Consolidate()
+    columns = []
+    for name in data.names:
+        if name in [c[0] for c in columns]:
+            continue
+        array = _np.ascontiguousarray(data._data.get(name, _np.array([])))
+        if array.dtype.kind == 'O':
+            raise ValueError("Column "+name+" holds python objects and can't be written")
+        columns.append((name, array))
+
+    header = {'names'      : list(data.names),
+              'units'      : list(data.units),
+              'nrows'      : len(data),
+              'columns'    : {},
+              'attributes' : {},
+              'source'     : source}
+    for attr in ['underflow', 'overflow']:
+        if hasattr(data, attr):
+            header['attributes'][attr] = float(getattr(data, attr))
+
+    # the offsets depend on the header length so lay out the header with
+    # placeholder offsets first and repeat until the length is stable.
+    offsets = [0]*len(columns)
+    while True:
+        for (name,array),offset in zip(columns,offsets):
+            header['columns'][name] = {'dtype' : array.dtype.str, 'offset' : offset}
+        headerbytes = _json.dumps(header, sort_keys=True).encode('utf-8')
+        position = len(_COLUMNARMAGIC) + 8 + len(headerbytes)
+        newoffsets = []
+        for name,array in columns:
+            position += (-position) % _COLUMNARALIGNMENT
+            newoffsets.append(position)
+            position += array.nbytes
+        if newoffsets == offsets:
+            break
+        offsets = newoffsets
+
+    tmppath = filepath + '.tmp' + str(_os.getpid())
+    f = open(tmppath, 'wb')
+    try:
+        f.write(_COLUMNARMAGIC)
+        f.write(_struct.pack('<Q', len(headerbytes)))
+        f.write(headerbytes)
+        for (name,array),offset in zip(columns,offsets):
+            f.write(b'\0'*(offset - f.tell()))
+            f.write(array.tobytes())
+    finally:
+        f.close()
+    if _os.path.exists(filepath):
+        _os.remove(filepath)
+    _os.rename(tmppath, filepath)
+
+def _ReadColumnarHeader(filepath):
+    f = open(filepath, 'rb')
+    try:
+        if f.read(len(_COLUMNARMAGIC)) != _COLUMNARMAGIC:
+            raise IOError("Not a pybdsim columnar file: "+filepath)
+        length = _struct.unpack('<Q', f.read(8))[0]
+        return _json.loads(f.read(length).decode('utf-8'))
+    finally:
+        f.close()
+
+def _ReadColumnar(filepath, source=None):
+    """
+    Open a binary columnar file as a BDSAsciiData instance whose columns
+    are read-only views of one memory map of the file, each made the first
+    time the column is used. If source is given, it must match the source recorded
+    in the file or a ValueError is raised.
+    """
+    header = _ReadColumnarHeader(filepath)
+    if source is not None and header['source'] != source:
+        raise ValueError("Columnar file "+filepath+" is out of date")
+    data  = BDSAsciiData()
+    for name,unit in zip(header['names'],header['units']):
+        data._AddProperty(str(name),str(unit))
+    specs = dict([(str(name), (_np.dtype(str(column['dtype'])), column['offset']))
+                  for name,column in header['columns'].items()])
+    # map the whole file now so the columns made later come from this
+    # file even if the path is overwritten or removed in the meantime
+    buffer = _np.memmap(filepath, dtype=_np.uint8, mode='r')
+    data._data  = _MappedColumns(buffer, header['nrows'], specs)
+    data._nrows = header['nrows']
+    for attr,value in header['attributes'].items():
+        setattr(data, str(attr), value)
+    return data
+
+def _IsColumnar(filepath):
+    f = open(filepath, 'rb')
+    magic = f.read(len(_COLUMNARMAGIC))
+    f.close()
+    return magic == _COLUMNARMAGIC
+
+_cache = {'enabled'   : False,
+          'directory' : None,
+          'maxsize'   : 4*1024**3}
+
+# list of the sidecars written next to their source files, so they can
+# be evicted and cleared like those in a cache directory
+_SIDECARINDEX = _os.path.join(_os.path.expanduser('~'), '.pybdsim', 'sidecars.txt')
+
+def EnableCache(directory=None, maxsize=4*1024**3):
+    """
+    Cache text files loaded with Load as binary columnar sidecar files.
+    Loading the same unchanged file again memory-maps the sidecar instead
+    of parsing the text.
+
+    directory - where to put the sidecars. The default of None writes
+                'filename.bdscol' next to each source file and lists it
+                in ~/.pybdsim/sidecars.txt.
+    maxsize   - total size in bytes of the sidecars kept in directory
+                (or of those listed for the default). The least recently
+                used ones are removed beyond this.
+
+    A sidecar is used only if the path, size, modification time and a
+    hash of the start and end of the source file all match.
+    """
+    _cache['enabled']   = True
+    _cache['directory'] = directory
+    _cache['maxsize']   = maxsize
+    if directory is not None and not _os.path.isdir(directory):
+        _os.makedirs(directory)
+
+def DisableCache():
+    """
+    Stop using the sidecar cache in Load. Existing sidecars are kept.
+    """
+    _cache['enabled'] = False
+
+def InvalidateCache(filepath):
+    """
+    Remove the cached sidecar of one source file, if any.
+    """
+    sidecar = _CachePath(filepath)
+    if _os.path.isfile(sidecar):
+        _os.remove(sidecar)
+
+def ClearCache():
+    """
+    Remove all sidecars from the cache directory and all those written
+    next to their source files.
+    """
+    for path in set(_CacheFiles() + _IndexedSidecars()):
+        try:
+            _os.remove(path)
+        except OSError:
+            pass
+    if _os.path.isfile(_SIDECARINDEX):
+        _os.remove(_SIDECARINDEX)
+
+def _CachePath(filepath):
+    if _cache['directory'] is None:
+        return filepath + '.bdscol'
+    key = _hashlib.sha1(_os.path.abspath(filepath).encode('utf-8')).hexdigest()
+    return _os.path.join(_cache['directory'], key + '.bdscol')
+
+def _CacheFiles():
+    directory = _cache['directory']
+    if directory is None:
+        return _IndexedSidecars()
+    if not _os.path.isdir(directory):
+        return []
+    return [_os.path.join(directory, f) for f in _os.listdir(directory) if f.endswith('.bdscol')]
+
+def _IndexedSidecars():
+    """
+    The sidecars written next to their source files that still exist.
+    """
+    if not _os.path.isfile(_SIDECARINDEX):
+        return []
+    f = open(_SIDECARINDEX)
+    paths = [line.rstrip('\n') for line in f if line.strip()]
+    f.close()
+    return sorted(set([p for p in paths if _os.path.isfile(p)]))
+
+def _IndexSidecar(sidecar):
+    """
+    Add a sidecar written next to its source file to the index, dropping
+    the ones that no longer exist.
+    """
+    sidecar = _os.path.abspath(sidecar)
+    paths   = _IndexedSidecars()
+    if sidecar in paths:
+        return
+    directory = _os.path.dirname(_SIDECARINDEX)
+    if not _os.path.isdir(directory):
+        _os.makedirs(directory)
+    tmppath = _SIDECARINDEX + '.tmp' + str(_os.getpid())
+    f = open(tmppath, 'w')
+    f.write(''.join([p + '\n' for p in paths + [sidecar]]))
+    f.close()
+    if _os.path.exists(_SIDECARINDEX):
+        _os.remove(_SIDECARINDEX)
+    _os.rename(tmppath, _SIDECARINDEX)
+
+def _CacheSource(filepath, samplesize=1024**2):
+    """
+    Describe the source file of a sidecar - path, size, modification
+    time and a hash of its first and last samplesize bytes.
+    """
+    stat = _os.stat(filepath)
+    h = _hashlib.sha1()
+    f = open(filepath, 'rb')
+    h.update(f.read(samplesize))
+    if stat.st_size > samplesize:
+        f.seek(max(samplesize, stat.st_size - samplesize))
+        h.update(f.read(samplesize))
+    f.close()
+    return {'path'  : _os.path.abspath(filepath),
+            'size'  : stat.st_size,
+            'mtime' : stat.st_mtime,
+            'hash'  : h.hexdigest()}
+
+def _LoadCached(filepath, loader):
+    source  = _CacheSource(filepath)
+    sidecar = _CachePath(filepath)
+    if _os.path.isfile(sidecar):
+        try:
+            data = _ReadColumnar(sidecar, source)
+            _os.utime(sidecar, None) # mark as recently used
+            return data
+        except (IOError, OSError, ValueError, KeyError):
+            pass # out of date or unreadable - parse the text again
+    data = loader(filepath)
+    try:
+        _WriteColumnar(data, sidecar, source)
+        if _cache['directory'] is None:
+            _IndexSidecar(sidecar)
+        _EvictCache()
+    except (IOError, OSError, ValueError):
+        pass # caching is only an optimisation
+    return data
+
+def _EvictCache():
+    """
+    Remove the least recently used sidecars until the cache directory (or
+    the listed sidecars next to their source files) is within the maximum
+    size.
+    """
+    files = [(_os.path.getmtime(f), _os.path.getsize(f), f) for f in _CacheFiles()]
+    total = sum([size for mtime,size,f in files])
+    for mtime,size,f in sorted(files):
+        if total <= _cache['maxsize']:
+            break
+        try:
+            _os.remove(f)
+            total -= size
+        except OSError:
+            pass
+
+_EVALBLOCKSIZE = 262144 # rows evaluated at a time by BDSAsciiData.Eval
+_EVALCACHESIZE = 8      # most recent Eval results kept per instance
+
+_EVALFUNCTIONS = {'sqrt'    : _np.sqrt,
+                  'abs'     : _np.abs,
+                  'exp'     : _np.exp,
+                  'log'     : _np.log,
+                  'log10'   : _np.log10,
+                  'sin'     : _np.sin,
+                  'cos'     : _np.cos,
+                  'tan'     : _np.tan,
+                  'arcsin'  : _np.arcsin,
+                  'arccos'  : _np.arccos,
+                  'arctan'  : _np.arctan,
+                  'arctan2' : _np.arctan2,
+                  'hypot'   : _np.hypot,
+                  'minimum' : _np.minimum,
+                  'maximum' : _np.maximum}
+
+_EVALCONSTANTS = {'pi' : _np.pi}
+
+_EVALOPERATORS = {_ast.Add      : _np.add,
+                  _ast.Sub      : _np.subtract,
+                  _ast.Mult     : _np.multiply,
+                  _ast.Div      : _np.true_divide,
+                  _ast.Mod      : _np.mod,
+                  _ast.Pow      : _np.power,
+                  _ast.BitAnd   : _np.logical_and,
+                  _ast.BitOr    : _np.logical_or,
+                  _ast.And      : _np.logical_and,
+                  _ast.Or       : _np.logical_or,
+                  _ast.USub     : _np.negative,
+                  _ast.UAdd     : _np.positive,
+                  _ast.Not      : _np.logical_not,
+                  _ast.Invert   : _np.logical_not,
+                  _ast.Lt       : _np.less,
+                  _ast.LtE      : _np.less_equal,
+                  _ast.Gt       : _np.greater,
+                  _ast.GtE      : _np.greater_equal,
+                  _ast.Eq       : _np.equal,
+                  _ast.NotEq    : _np.not_equal}
+
+def _CompileExpression(expression):
+    """
+    Compile an expression of column names, numbers, arithmetic, comparison
+    and logical operators and the functions in _EVALFUNCTIONS into a python
+    function. The function takes a function that returns the values of a
+    named column and returns the values of the expression.
+    """
+    try:
+        tree = _ast.parse(expression.strip(), mode='eval')
+    except SyntaxError:
+        raise ValueError("Invalid expression: "+expression)
+    return _CompileNode(tree.body, expression)
+
+def _CompileNode(node, expression):
+    def Operator(op):
+        if type(op) not in _EVALOPERATORS:
+            raise ValueError("Unsupported operator in expression: "+expression)
+        return _EVALOPERATORS[type(op)]
+
+    if isinstance(node, _ast.BinOp):
+        op, left, right = Operator(node.op), _CompileNode(node.left, expression), _CompileNode(node.right, expression)
+        return lambda column: op(left(column), right(column))
+    elif isinstance(node, _ast.UnaryOp):
+        op, operand = Operator(node.op), _CompileNode(node.operand, expression)
+        return lambda column: op(operand(column))
+    elif isinstance(node, _ast.BoolOp):
+        op, values = Operator(node.op), [_CompileNode(v, expression) for v in node.values]
+        return lambda column: _functools.reduce(op, [v(column) for v in values])
+    elif isinstance(node, _ast.Compare):
+        # a < b < c is (a < b) & (b < c)
+        operands = [_CompileNode(n, expression) for n in [node.left] + list(node.comparators)]
+        ops      = [Operator(op) for op in node.ops]
+        def Compare(column):
+            values = [o(column) for o in operands]
+            return _functools.reduce(_np.logical_and, [op(values[i], values[i+1]) for i,op in enumerate(ops)])
+        return Compare
+    elif isinstance(node, _ast.Call):
+        if not isinstance(node.func, _ast.Name) or node.func.id not in _EVALFUNCTIONS or len(node.keywords) > 0:
+            raise ValueError("Unsupported function in expression: "+expression)
+        function, args = _EVALFUNCTIONS[node.func.id], [_CompileNode(a, expression) for a in node.args]
+        return lambda column: function(*[a(column) for a in args])
+    elif isinstance(node, _ast.Name):
+        if node.id in ('True', 'False'): # python 2
+            value = node.id == 'True'
+            return lambda column: value
+        name = node.id
+        return lambda column: column(name)
+    elif type(node).__name__ in ('Num', 'Constant', 'NameConstant'):
+        value = getattr(node, 'value', getattr(node, 'n', None))
+        if not isinstance(value, (int, float, bool)):
+            raise ValueError("Unsupported constant in expression: "+expression)
+        return lambda column: value
+    else:
+        raise ValueError("Unsupported expression: "+expression)
+
+class _FilteredColumns(dict):
+    """
+    Columns of a filtered BDSAsciiData instance. Each column is gathered
+    from the parent's array with the selected row indices the first time
+    it is used. Filtering again composes the indices with the parent's
+    so a chain of filters always gathers from the original arrays.
+    """
+    def __init__(self, parentcolumns, indices):
+        dict.__init__(self)
+        if isinstance(parentcolumns, _FilteredColumns):
+            indices       = parentcolumns.indices[indices]
+            parentcolumns = parentcolumns.parent
+        self.parent  = _CopyColumns(parentcolumns) # references only - no copy of the arrays
+        self.indices = indices
+
+    def __missing__(self, name):
+        column = self.parent[name][self.indices]
+        self[name] = column
+        return column
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or name in self.parent
+
+    def keys(self):
+        # the parent's columns, gathered or not, and any set on this one
+        names = list(self.parent.keys())
+        return names + [name for name in dict.keys(self) if name not in self.parent]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def Copy(self):
+        c = _FilteredColumns(self.parent, self.indices)
+        c.update(self)
+        return c
+
+class _MappedColumns(dict):
+    """
+    Columns of a BDSAsciiData instance opened from a binary columnar file.
+    The file is memory-mapped once as a whole and each column is made as a
+    view of its block of the map the first time it is used, so opening
+    the file reads only its header and using a column reads only the
+    pages of that column.
+    """
+    def __init__(self, buffer, nrows, specs):
+        dict.__init__(self)
+        self.buffer = buffer # read-only uint8 memory map of the whole file
+        self.nrows  = nrows
+        self.specs  = specs  # name -> (dtype, offset in file)
+
+    def __missing__(self, name):
+        dtype, offset = self.specs[name]
+        column = _np.ndarray((self.nrows,), dtype=dtype, buffer=self.buffer, offset=offset)
+        self[name] = column
+        return column
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or name in self.specs
+
+    def keys(self):
+        # the columns in the file, mapped or not, and any set since
+        names = list(self.specs)
+        return names + [name for name in dict.keys(self) if name not in self.specs]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def Copy(self):
+        c = _MappedColumns(self.buffer, self.nrows, self.specs)
+        c.update(self)
+        return c
+
+def _CopyColumns(columns):
+    """
+    Shallow copy of the column arrays of a BDSAsciiData instance that
+    keeps lazily gathered or mapped columns lazy.
+    """
+    if hasattr(columns, 'Copy'):
+        return columns.Copy()
+    return dict(columns)
+
+class BDSAsciiData(object):
     """
     General class representing simple 2 column data.
 
-    Inherits python list.  It's a list of tuples with extra columns of 'name' and 'units'.
+    The data is stored column-wise as one contiguous numpy array per
+    variable with extra lists of 'names' and 'units'. It behaves like a
+    list of tuples - len(), iteration, slicing, append(), extend(),
+    insert(), pop(), remove(), index(), count(), sort() and reverse() work
+    on rows - but it is no longer a subclass of list, so isinstance(data,
+    list) is False.
+
+    The generated column getters, e.g. data.S(), return read-only views
+    of the stored arrays rather than building a new array every time.
+    Copy one before changing it in place (s = data.S().copy(); s -= s[0]).
+    GetColumn returns a new array that can be changed freely.
+
+    Rows appended one at a time are buffered and converted to columns
+    the first time a column is requested.
     """
-    def __init__(self, *args, **kwargs):
-        list.__init__(self, *args, **kwargs)
-        self.units   = []
-        self.names   = []
-        self.columns = self.names
+    def __init__(self, rows=None):
+        self.units    = []
+        self.names    = []
+        self.columns  = self.names
+        self._data    = {}   # name -> contiguous numpy array
+        self._derived = {}   # quantities cached until the data changes
+        self._nrows   = 0    # number of rows held in self._data
+        self._pending = []   # rows appended but not yet converted to columns
+        if rows is not None:
+            self.extend(rows)
+
+    def __len__(self):
+        return self._nrows + len(self._pending)
+
+    def __iter__(self):
+        self._Consolidate()
+        if len(self.names) == 0:
+            return iter([])
+        return iter(zip(*[self._data[name].tolist() for name in self.names]))
 
     def __getitem__(self,index):
-        return dict(zip(self.names,list.__getitem__(self,index)))
+        if isinstance(index, slice):
+            return [dict(zip(self.names,row)) for row in self.GetItemTuple(index)]
+        return dict(zip(self.names,self.GetItemTuple(index)))
 
     def GetItemTuple(self,index):
         """
         Get a specific entry in the data as a tuple of values rather than a dictionary.
+        A slice gives a list of tuples.
         """
-        return list.__getitem__(self,index)
-        
+        self._Consolidate()
+        if isinstance(index, slice):
+            rows = range(self._nrows)[index]
+            if len(rows) == 0 or len(self.names) == 0:
+                return []
+            return list(zip(*[self._data[name][index].tolist() for name in self.names]))
+        if index < -self._nrows or index >= self._nrows:
+            raise IndexError("BDSAsciiData index out of range")
+        if index < 0:
+            index += self._nrows
+        return tuple(self._data[name][index:index+1].tolist()[0] for name in self.names)
+
+    def append(self, row):
+        """
+        Append a single row (tuple of values in the order of names).
+        """
+        row = tuple(row)
+        if len(self.names) > 0:
+            self._CheckRow(len(self), row)
+        self._pending.append(row)
+
+    def extend(self, rows):
+        """
+        Append an iterable of rows.
+        """
+        for row in rows:
+            self.append(row)
+
+    def insert(self, index, row):
+        """
+        Insert a single row before index.
+        """
+        self._Consolidate()
+        if self._nrows == 0:
+            self.append(row)
+            return
+        row = tuple(row)
+        self._CheckRow(index, row)
+        if index < 0:
+            index += self._nrows
+        index = min(max(index, 0), self._nrows)
+        columns = {}
+        for name,value in zip(self.names,row):
+            column = self._data[name]
+            columns[name] = _np.concatenate((column[:index], _np.array([value]), column[index:]))
+        self._data   = columns
+        self._nrows += 1
+        self._derived.clear()
+
+    def pop(self, index=-1):
+        """
+        Remove the row at index and return it as a tuple.
+        """
+        row = self.GetItemTuple(index)
+        if index < 0:
+            index += self._nrows
+        keep = _np.ones(self._nrows, dtype=bool)
+        keep[index] = False
+        self._data   = dict([(name, self._data[name][keep]) for name in set(self.names)])
+        self._nrows -= 1
+        self._derived.clear()
+        return row
+
+    def index(self, row):
+        """
+        Index of the first row equal to row (a tuple of values in the order
+        of names).
+        """
+        row = tuple(row)
+        for i,r in enumerate(self):
+            if r == row:
+                return i
+        raise ValueError(str(row)+" is not in the data")
+
+    def count(self, row):
+        """
+        Number of rows equal to row.
+        """
+        row = tuple(row)
+        return sum([1 for r in self if r == row])
+
+    def remove(self, row):
+        """
+        Remove the first row equal to row.
+        """
+        self.pop(self.index(row))
+
+    def sort(self, key=None, reverse=False):
+        """
+        Sort the rows in place - as tuples of values by default.
+        """
+        rows  = list(self)
+        if key is None:
+            order = sorted(range(len(rows)), key=lambda i: rows[i], reverse=reverse)
+        else:
+            order = sorted(range(len(rows)), key=lambda i: key(rows[i]), reverse=reverse)
+        self._Reorder(_np.array(order, dtype=int))
+
+    def reverse(self):
+        """
+        Reverse the order of the rows in place.
+        """
+        self._Reorder(_np.arange(len(self))[::-1])
+
+    def _Reorder(self, order):
+        """
+        Put the rows in the order of the array of row indices order.
+        """
+        self._Consolidate()
+        if self._nrows == 0:
+            return
+        self._data = dict([(name, self._data[name][order]) for name in set(self.names)])
+        self._derived.clear()
+
+    def _Consolidate(self):
+        """
+        Convert any buffered rows into the column arrays.
+        """
+        if len(self._pending) == 0:
+            return
+        # rows may have been appended before the names were set, so check
+        # them all before changing any column
+        for i,row in enumerate(self._pending):
+            if len(row) != len(self.names):
+                self._CheckRow(self._nrows + i, row)
+        pending = list(zip(*self._pending))
+        for i,name in enumerate(self.names):
+            newvalues = _np.array(pending[i])
+            if name in self._data and self._nrows > 0:
+                self._data[name] = _np.concatenate((self._data[name], newvalues))
+            else:
+                self._data[name] = newvalues
+        self._nrows  += len(self._pending)
+        self._pending = []
+        self._derived.clear()
+
+    def _CheckRow(self, index, row):
+        if len(row) != len(self.names):
+            raise ValueError("Row "+str(index)+" "+str(row)+" has "+str(len(row))+
+                             " values but the data has "+str(len(self.names))+" columns")
+
+    def _SetColumn(self, variablename, array):
+        """
+        Store a whole column at once. The array must have the same length
+        as the data already present.
+        """
+        self._Consolidate()
+        array = _np.ascontiguousarray(array)
+        if len(self._data) == 0:
+            self._nrows = len(array)
+        elif len(array) != self._nrows:
+            raise ValueError("Column "+variablename+" has "+str(len(array))+
+                             " entries but the data has "+str(self._nrows))
+        self._data[variablename] = array
+        self._derived.clear()
+
+    def _GetColumnView(self, variablename):
+        """
+        Return a read-only view of the stored column - no copy is made.
+        """
+        self._Consolidate()
+        if variablename not in self._data:
+            if self._nrows == 0:
+                return _np.array([])
+            raise KeyError(variablename+" is not a variable in this data")
+        view = self._data[variablename].view()
+        view.flags.writeable = False
+        return view
+
+    def _ShallowCopy(self):
+        """
+        Return a new instance with the same names and units that shares
+        this instance's column arrays.
+        """
+        self._Consolidate()
+        a = BDSAsciiData()
+        a._DuplicateNamesUnits(self)
+        a._data  = _CopyColumns(self._data)
+        a._nrows = self._nrows
+        for attr in ['underflow', 'overflow', 'sources']:
+            if hasattr(self, attr):
+                setattr(a, attr, getattr(self, attr))
+        return a
+
     def _AddMethod(self, variablename):
         """
         This is used to dynamically add a getter function for a variable name.
@@ -151,59 +1703,62 @@ class BDSAsciiData(list):
         def GetAttribute():
             if self.names.count(variablename) == 0:
                 raise KeyError(variablename+" is not a variable in this data")
-            ind = self.names.index(variablename)
-            return _np.array([event[ind] for event in self])
+            return self._GetColumnView(variablename)
         setattr(self,variablename,GetAttribute)
 
-    def ConcatenateMachine(self,*args):
+    def ConcatenateMachine(self,*args,**kwargs):
         """
         This is used to concatenate machines.
+
+        Each argument is a BDSAsciiData instance or the path of a file to
+        load. The S positions ('S', or 'SStart', 'SMid' and 'SEnd' for a
+        survey) of each machine are offset by the end of the machine before.
+
+        workers - number of processes used to load the machines given as
+                  paths. The default of 1 loads them one after another here.
         """
-        #Get final position of the machine (different param for survey)
-        if _General.IsSurvey(self):
-            lastSpos = self.GetColumn('SEnd')[-1]
+        workers = kwargs.pop('workers', 1)
+        if len(kwargs) > 0:
+            raise TypeError("Unexpected keyword arguments: "+str(list(kwargs.keys())))
+
+        paths    = [m for m in args if isinstance(m,str)]
+        loaded   = dict(zip(paths, _LoadPaths(paths, workers)))
+        machines = [loaded[m] if isinstance(m,str) else m for m in args]
+
+        #surveys have multiple s positions per element
+        if 'SStart' in self.names:
+            scolumns  = ['SStart','SMid','SEnd']
+            endcolumn = 'SEnd'
+        elif 'S' in self.names:
+            scolumns  = ['S']
+            endcolumn = 'S'
         else:
-            lastSpos = self.GetColumn('S')[-1]
-        
-        for machine in args:
-            if isinstance(machine,_np.str):
-                machine = Load(machine)
-        
-            #check names sets are equal
+            raise KeyError("S is not a variable in this data")
+
+        #check names sets are equal
+        for machine in machines:
             if len(set(self.names).difference(set(machine.names))) != 0:
                 raise AttributeError("Cannot concatenate machine, variable names do not match")
-        
-            #surveys have multiple s positions per element
-            if _General.IsSurvey(machine):
-                sstartind = self.names.index('SStart')
-                smidind = self.names.index('SMid')
-                sendind = self.names.index('SEnd')
-            elif self.names.count('S') != 0:
-                sind = self.names.index('S')
-            else:
-                raise KeyError("S is not a variable in this data")
-        
-            #Have to convert each element to a list as tuples can't be modified
-            for index in range(len(machine)):
-                element = machine.GetItemTuple(index)
-                elementlist = list(element)
-                
-                #update the elements S position
-                if _General.IsSurvey(machine):
-                    elementlist[sstartind] += lastSpos
-                    elementlist[smidind] += lastSpos
-                    elementlist[sendind] += lastSpos
-                else:
-                    elementlist[sind] += lastSpos
-                
-                self.append(tuple(elementlist))
-                
-            #update the total S position.
-            if _General.IsSurvey(machine):
-                lastSpos += machine.GetColumn('SEnd')[-1]
-            else:
-                lastSpos += machine.GetColumn('S')[-1]
 
+        #Get final position of the machine and the offset of each one after
+        self._Consolidate()
+        lastSpos = self._data[endcolumn][-1] if self._nrows > 0 else 0.0
+        offsets  = []
+        for machine in machines:
+            offsets.append(lastSpos)
+            if len(machine) > 0:
+                lastSpos += machine._GetColumnView(endcolumn)[-1]
+
+        columns = {}
+        for name in set(self.names):
+            parts = [self._data.get(name, _np.array([]))]
+            for machine,offset in zip(machines,offsets):
+                column = machine._GetColumnView(name)
+                parts.append(column + offset if name in scolumns else column)
+            columns[name] = _JoinBlocks(parts)
+        self._data  = columns
+        self._nrows = self._nrows + sum([len(m) for m in machines])
+        self._derived.clear()
 
     def _AddProperty(self,variablename,variableunit='NA'):
         """
@@ -234,12 +1789,8 @@ class BDSAsciiData(list):
         Return type is BDSAsciiData
         """
         if hasattr(self,parametername):
-            a = BDSAsciiData()            #build bdsasciidata2
-            a._DuplicateNamesUnits(self)   #copy names and units
-            pindex = a.names.index(parametername)
-            filtereddata = [event for event in self if abs(event[pindex]-matchvalue)<=tolerance]
-            a.extend(filtereddata)
-            return a
+            values = self._GetColumnView(parametername)
+            return self._View(_np.abs(values-matchvalue) <= tolerance)
         else:
             print("The parameter: ",parametername," does not exist in this instance")
 
@@ -248,13 +1799,196 @@ class BDSAsciiData(list):
         Filter the data with a booleanarray.  Where true, will return
         that event in the data.
 
+        booleanarray may also be a function that takes this instance and
+        returns the boolean array, e.g.
+
+        >>> a.Filter(lambda d: d.E() > 1.0).Filter(lambda d: d.Z() < 10.0)
+
+        The result shares the column arrays of this instance and only
+        copies the selected rows of a column when that column is used.
+        Filtering a filtered instance selects from the original data.
+
         Return type is BDSAsciiData
         """
+        if callable(booleanarray):
+            booleanarray = booleanarray(self)
+        mask = _np.asarray(booleanarray, dtype=bool)
+        if len(mask) < len(self):
+            raise IndexError("booleanarray is shorter than the data")
+        return self._View(mask[:len(self)])
+
+    def _View(self, mask):
+        """
+        Return a BDSAsciiData instance of the rows where mask is true that
+        gathers its columns lazily from this instance's column arrays.
+        """
+        self._Consolidate()
         a = BDSAsciiData()
         a._DuplicateNamesUnits(self)
-        a.extend([event for i,event in enumerate(self) if booleanarray[i]])
+        a._data  = _FilteredColumns(self._data, _np.flatnonzero(mask))
+        a._nrows = len(a._data.indices)
+        for attr in ['underflow', 'overflow', 'sources']:
+            if hasattr(self, attr):
+                setattr(a, attr, getattr(self, attr))
         return a
 
+    def Eval(self, expression, blocksize=_EVALBLOCKSIZE):
+        """
+        Evaluate an expression of the columns and return a (read-only) array
+        with one value per row, e.g.
+
+        >>> r = a.Eval("sqrt(X**2 + Y**2)")
+        >>> b = a.Eval("Beta_x * Emitt_x")
+
+        Expressions may use column names, numbers, pi, + - * / % **,
+        comparisons (chained too, e.g. "0 < S < 10"), and / or / not (or
+        & | ~), and the functions sqrt, abs, exp, log, log10, sin, cos,
+        tan, arcsin, arccos, arctan, arctan2, hypot, minimum and maximum.
+
+        The expression is evaluated blocksize rows at a time so the
+        temporary arrays stay small. The results of the last few
+        expressions are kept until the data changes, so evaluating the
+        same expression again is free.
+        """
+        self._Consolidate()
+        cache = self._derived.setdefault('eval', _collections.OrderedDict())
+        if expression in cache:
+            result = cache.pop(expression)
+        else:
+            result = self._Evaluate(expression, blocksize)
+        cache[expression] = result # most recently used last
+        while len(cache) > _EVALCACHESIZE:
+            cache.popitem(last=False)
+        view = result.view()
+        view.flags.writeable = False
+        return view
+
+    def _Evaluate(self, expression, blocksize=_EVALBLOCKSIZE):
+        """
+        Evaluate an expression of the columns without caching the result.
+        """
+        self._Consolidate()
+        function = _CompileExpression(expression)
+        nrows    = len(self)
+        result   = None
+        for start in range(0, max(nrows,1), blocksize):
+            stop = min(start+blocksize, nrows)
+            def Column(name):
+                if name in self.names:
+                    return self._GetColumnView(name)[start:stop]
+                elif name in _EVALCONSTANTS:
+                    return _EVALCONSTANTS[name]
+                raise KeyError(name+" is not a variable in this data")
+            values = _np.asarray(function(Column))
+            if values.ndim == 0:
+                values = _np.full(stop-start, values)
+            if result is None:
+                result = _np.empty(nrows, dtype=values.dtype)
+            result[start:stop] = values
+        return result
+
+    def Where(self, expression):
+        """
+        Filter the data with a boolean expression of the columns (see Eval
+        and Filter), e.g.
+
+        >>> b = a.Where("(E > 0.1) & (abs(X) < 0.01)")
+
+        The mask is not kept, so a sweep of cuts doesn't hold an array
+        per cut.
+        """
+        cache = self._derived.get('eval', {})
+        if expression in cache:
+            mask = cache[expression]
+        else:
+            mask = self._Evaluate(expression)
+        if mask.dtype != bool:
+            raise ValueError("Expression doesn't give true or false for each row: "+expression)
+        return self.Filter(mask)
+
+    def ResampleS(self, grid, columns=None, method="linear", outside="clip"):
+        """
+        Return a new BDSAsciiData instance with columns evaluated at the S
+        positions in grid, e.g. to compare optics sampled at different
+        points.
+
+        columns - names of the columns to resample (default all but S).
+        method  - "linear" interpolation between samples, "nearest" sample
+                  or "previous" sample (the last one at or before each S).
+                  Columns that aren't numbers always use "previous".
+        outside - for S outside the data, "clip" to the first / last values
+                  or "nan".
+
+        Where S is repeated, e.g. before and after a thin element or at a
+        boundary where a function jumps, a grid point exactly at that S
+        takes the value after the jump and points either side interpolate
+        towards the value on their own side.
+
+        Uses the 'S' column, or 'SStart' if there is no 'S'.
+        """
+        if method not in ("linear", "nearest", "previous"):
+            raise ValueError("method must be 'linear', 'nearest' or 'previous'")
+        if outside not in ("clip", "nan"):
+            raise ValueError("outside must be 'clip' or 'nan'")
+        scolumn = "S" if "S" in self.names else "SStart"
+        if scolumn not in self.names:
+            raise ValueError("This file doesn't have the required column S")
+        if columns is None:
+            columns = [n for n in self.names if n != scolumn]
+
+        s, order = self._SortedS(scolumn)
+        grid = _np.asarray(grid, dtype=float).ravel()
+        nmax = len(s) - 1
+        # last sample at or before each grid point and the one after it
+        lower = _np.clip(_np.searchsorted(s, grid, side='right') - 1, 0, nmax)
+        upper = _np.clip(lower + 1, 0, nmax)
+        gap   = s[upper] - s[lower]
+        with _np.errstate(divide='ignore', invalid='ignore'):
+            weight = _np.where(gap > 0, (grid - s[lower]) / gap, 0.0)
+        weight = _np.clip(weight, 0.0, 1.0)
+        if method == "nearest":
+            pick = _np.where(weight > 0.5, upper, lower)
+        else:
+            pick = lower
+        outofrange = (grid < s[0]) | (grid > s[-1])
+
+        numeric = [c for c in columns if self._GetColumnView(c).dtype.kind in 'fiub']
+        others  = [c for c in columns if c not in numeric]
+        resampled = {}
+        if len(numeric) > 0:
+            values = _np.column_stack([self._GetColumnView(c) for c in numeric]).astype(float)[order]
+            if method == "linear":
+                w = weight[:,None]
+                result = values[lower]*(1.0-w) + values[upper]*w
+            else:
+                result = values[pick]
+            if outside == "nan":
+                result[outofrange] = _np.nan
+            for i,c in enumerate(numeric):
+                resampled[c] = result[:,i]
+        for c in others:
+            result = self._GetColumnView(c)[order][lower if method == "linear" else pick]
+            if outside == "nan":
+                result[outofrange] = ''
+            resampled[c] = result
+
+        names = [scolumn] + list(columns)
+        units = [self.units[self.names.index(n)] for n in names]
+        return _BuildFromColumns(names, units, [grid] + [resampled[c] for c in columns])
+
+    def _SortedS(self, scolumn):
+        """
+        Return the S positions sorted and the indices that sort them,
+        cached until the data changes.
+        """
+        self._Consolidate()
+        key = ('sorteds', scolumn)
+        if key not in self._derived:
+            s = _np.asarray(self._GetColumnView(scolumn), dtype=float)
+            order = _np.argsort(s, kind='mergesort')
+            self._derived[key] = (s[order], order)
+        return self._derived[key]
+
     def NameFromNearestS(self,S):
         i = self.IndexFromNearestS(S)
         if not hasattr(self,"Name"):
@@ -274,34 +2008,172 @@ class BDSAsciiData(list):
             raise ValueError("This file doesn't have the required column SStart")
         if not hasattr(self,"Arc_len"):
             raise ValueError("This file doesn't have the required column Arc_len")
-        s = self.SStart()
-        l = self.Arc_len()
+        sstart, send, order = self._SIndex()
 
-        #iterate over beamline and record element if S is between the
-        #sposition of that element and then next one
+        #find the element with S strictly between its start and end
         #note madx S position is the end of the element by default
-        ci = [i for i in range(len(self)-1) if (S > s[i] and S < s[i]+l[i])]
-        try:
-            ci = ci[0] #return just the first match - should only be one
-        except IndexError:
-            #protect against S positions outside range of machine
-            if S > s[-1]:
-                ci =-1
+        i = _np.searchsorted(sstart, S, side='left') - 1
+        if i >= 0 and S < send[i]:
+            ci = i if order is None else order[i]
+            if ci < len(self)-1:
+                return int(ci)
+        #protect against S positions outside range of machine
+        if S > self._data['SStart'][-1]:
+            return -1
+        else:
+            return 0
+
+    def _SIndex(self):
+        """
+        Return (sstart, send, order) - the element start and end S positions
+        sorted by start and the indices that sort them (None if the data is
+        already in order). Built once and cached until the data changes.
+        """
+        self._Consolidate()
+        if 'sindex' not in self._derived:
+            if 'SStart' not in self._data:
+                raise ValueError("This file doesn't have the required column SStart")
+            sstart = _np.asarray(self._data['SStart'], dtype=float)
+            if 'Arc_len' in self._data:
+                send = sstart + self._data['Arc_len']
+            elif 'SEnd' in self._data:
+                send = _np.asarray(self._data['SEnd'], dtype=float)
             else:
-                ci = 0
-        #check the absolute distance to each and return the closest one
-        #make robust against s positions outside machine range
-        return ci
+                raise ValueError("This file doesn't have the required column Arc_len")
+            order = None
+            if _np.any(_np.diff(sstart) < 0):
+                order  = _np.argsort(sstart, kind='mergesort')
+                sstart = sstart[order]
+                send   = send[order]
+            self._derived['sindex'] = (sstart, send, order)
+        return self._derived['sindex']
+
+    def _SEndMax(self):
+        """
+        Return the largest end S of the elements up to each one in order of
+        start S, cached until the data changes.
+        """
+        if 'sendmax' not in self._derived:
+            sstart, send, order = self._SIndex()
+            self._derived['sendmax'] = _np.maximum.accumulate(send)
+        return self._derived['sendmax']
+
+    def _NameIndex(self):
+        """
+        Return a dictionary of the row index of each name (the first row
+        for repeated names), cached until the data changes.
+        """
+        self._Consolidate()
+        if 'nameindex' not in self._derived:
+            if "Name" not in self.names:
+                raise ValueError("This file doesn't have the required column Name")
+            names = self._GetColumnView("Name").tolist()
+            index = {}
+            for i in range(len(names)-1, -1, -1):
+                index[names[i]] = i
+            self._derived['nameindex'] = index
+        return self._derived['nameindex']
+
+    def IndicesFromS(self, S, outside='clip', wrap=False):
+        """
+        Return the index of the element containing each S position, where
+        an element covers SStart <= S < SStart + Arc_len. S may be a single
+        value or an array of any shape.
+
+        outside - what to do with S that no element contains - before the
+                  first element, at or after the end of the last one or in
+                  a gap between elements: 'clip' (default) gives the first
+                  index, the last index or the element before the gap,
+                  'flag' gives -1 and 'raise' raises a ValueError.
+        wrap    - for circular machines, take S modulo the machine length.
+
+        Requires the "SStart" and "Arc_len" (or "SEnd") columns.
+        """
+        if outside not in ('clip', 'flag', 'raise'):
+            raise ValueError("outside must be one of 'clip', 'flag' or 'raise'")
+        sstart, send, order = self._SIndex()
+        s = _np.atleast_1d(_np.asarray(S, dtype=float))
+        if wrap:
+            length = send.max() - sstart[0]
+            s = sstart[0] + _np.mod(s - sstart[0], length)
+        inds   = _np.searchsorted(sstart, s, side='right') - 1
+        before = inds < 0
+        inds   = _np.clip(inds, 0, len(sstart)-1)
+        # the last element starting at or before S may not contain it when
+        # elements overlap (e.g. zero length markers) - look further back
+        ends   = self._SEndMax()
+        behind = ~before & (s >= send[inds]) & (s < ends[inds])
+        for i in _np.flatnonzero(behind):
+            while s[i] >= send[inds[i]]:
+                inds[i] -= 1
+        after  = ~before & (s >= ends[-1])
+        gap    = ~before & (s >= ends[inds]) & ~after
+        if order is not None:
+            inds = order[inds]
+        if _np.any(before) or _np.any(after) or _np.any(gap):
+            if outside == 'raise':
+                raise ValueError("S positions outside the elements of the machine")
+            elif outside == 'flag':
+                inds[before | after | gap] = -1
+            else:
+                inds[before] = 0 if order is None else order[0]
+                inds[after]  = len(sstart)-1 if order is None else order[-1]
+        if _np.ndim(S) == 0:
+            return int(inds[0])
+        return inds.reshape(_np.shape(S))
+
+    def NamesFromS(self, S, outside='clip', wrap=False):
+        """
+        Return the name of the element containing each S position - see
+        IndicesFromS for the arguments. Positions flagged as outside the
+        machine get an empty name.
+        """
+        if "Name" not in self.names:
+            raise ValueError("This file doesn't have the required column Name")
+        inds  = _np.asarray(self.IndicesFromS(S, outside, wrap))
+        names = self._GetColumnView("Name")[inds]
+        if _np.ndim(names) == 0:
+            return '' if inds < 0 else names
+        names = names.copy()
+        names[inds < 0] = ''
+        return names
+
+    def Save(self, filepath):
+        """
+        Save the data to a binary columnar file that Load opens again.
+
+        The file holds the names, units, dtype of each column and each
+        column as one contiguous block, so loading it memory-maps the
+        columns rather than parsing anything and only the columns that
+        are used are read from disk. Columns of python objects (e.g. some
+        ROOT branches) can't be saved.
+        """
+        _WriteColumnar(self, filepath)
+
+    def __getstate__(self):
+        # the getter functions are closures that can't be pickled - they
+        # are made again from the names when unpickling
+        self._Consolidate()
+        state = dict([(k,v) for k,v in self.__dict__.items()
+                      if not (k in self.names and callable(v))])
+        state['_data']    = dict([(n, _np.asarray(self._data[n])) for n in set(self.names) if n in self._data])
+        state['_derived'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name in self.names:
+            self._AddMethod(name)
 
     def GetColumn(self,columnstring):
         """
         Return a numpy array of the values in columnstring in order
-        as they appear in the beamline
+        as they appear in the beamline. This is a copy - use the getter
+        (e.g. data.S()) for a read-only view of the stored column.
         """
         if columnstring not in self.columns:
             raise ValueError("Invalid column name")
-        ind = self.names.index(columnstring)
-        return _np.array([element[ind] for element in self])
+        return self._GetColumnView(columnstring).copy()
 
     def __repr__(self):
         s = ''
@@ -1,5 +1,85 @@
 import numpy as _np
 
+_WRITEBLOCKROWS = 65536 # rows formatted at a time by Field.Write
+
+
+def _FormatRows(block, valueFormat):
+    """
+    Format a 2D block of rows with valueFormat for every value, tab separated
+    and one row per line, using a single template for the whole block.
+    """
+    rowFormat = '\t'.join([valueFormat]*block.shape[1]) + '\n'
+    return (rowFormat*len(block)) % tuple(block.ravel().tolist())
+
+
+def _FormatRowsSingle(block):
+    """
+    Format a 2D block of rows exactly as _FormatRows(block, '%14.8E') would but
+    building the characters with numpy rather than value by value.
+
+    The 9 significant digits are found in double arithmetic, which decides the
+    rounding correctly except very close to a tie. Rows with any such value,
+    any nan or inf, or a 3 digit exponent are formatted by python instead.
+    """
+    nrows, nvalues = block.shape
+    v    = _np.asarray(block, dtype=_np.float64).ravel()
+    av   = _np.abs(v)
+    zero = av == 0
+    with _np.errstate(all='ignore'):
+        exp    = _np.floor(_np.log10(_np.where(zero, 1.0, av)))
+        scaled = av * 10.0**(8 - exp) + 0.5
+        mant   = _np.floor(scaled)
+        scaled -= mant
+        tie    = (scaled < 1e-4) | (scaled > 1 - 1e-4)
+    carry = mant == 1e9 # rounding up to the next power of 10
+    mant[carry] = 1e8
+    exp[carry] += 1
+    bad = (~_np.isfinite(v) | tie | (_np.abs(exp) > 99) |
+           (~zero & ((mant < 1e8) | (mant >= 1e9))))
+    mant[bad] = 0
+    exp[bad]  = 0
+
+    # one row of characters per position in '-d.ddddddddE+dd\t' so each is
+    # written contiguously, then transposed to one value after another.
+    # values are right aligned in 14 characters so only negative ones have
+    # the leading character - 0 marks characters to drop.
+    chars = _np.empty((16, len(v)), dtype=_np.uint8)
+    chars[0]  = _np.where(_np.signbit(v), ord('-'), 0)
+    chars[2]  = ord('.')
+    chars[11] = ord('E')
+    m = mant.astype(_np.int32)
+    for position in (10, 9, 8, 7, 6, 5, 4, 3, 1): # digits from the last
+        q = m // 10
+        chars[position] = m - q*10 + ord('0')
+        m = q
+    e = exp.astype(_np.int32)
+    chars[12] = _np.where(e < 0, ord('-'), ord('+'))
+    e = _np.abs(e)
+    q = e // 10
+    chars[13] = q + ord('0')
+    chars[14] = e - q*10 + ord('0')
+    chars[15] = ord('\t')
+    chars[15].reshape(nrows, nvalues)[:,-1] = ord('\n')
+
+    badRows = _np.flatnonzero(bad.reshape(nrows, nvalues).any(axis=1))
+    chars.reshape(16, nrows, nvalues)[:,badRows] = 0
+    text = chars.T.tobytes().replace(b'\0', b'').decode('ascii')
+    if len(badRows) == 0:
+        return text
+
+    # splice python formatted rows in where they belong
+    rowLengths = _np.count_nonzero(chars.reshape(16, nrows, nvalues), axis=(0,2))
+    rowEnds    = _np.cumsum(rowLengths)
+    pieces     = []
+    start      = 0
+    for row in badRows:
+        end = int(rowEnds[row])
+        pieces.append(text[start:end])
+        pieces.append(_FormatRows(block[row:row+1], '%14.8E'))
+        start = end
+    pieces.append(text[start:])
+    return ''.join(pieces)
+
 
 class Field(object):
     """
@@ -15,19 +95,35 @@ class Field(object):
         self.flip            = flip
         self.doublePrecision = doublePrecision       
 
-    def Write(self, fileName):
+    def Write(self, fileName, binary=False):
+        """
+        Write the field map to fileName in BDSIM field format.
+
+        If binary is True, the same header is followed by the values as raw
+        little endian float32 (float64 if doublePrecision) in the same order
+        instead of text. This is much faster to write and Load memory maps it.
+        """
+        if binary:
+            f = open(fileName, 'wb')
+            header = ''.join([str(key)+'> '+ str(value) + '\n' for key,value in self.header.items()])
+            header += 'binary> ' + str(_BinaryDtype(self.doublePrecision).itemsize) + '\n'
+            header += _PadColumnLine(_ColumnLine(self.columns, self.doublePrecision), len(header))
+            f.write(header.encode('ascii'))
+            _WriteBinaryRows(f, self._Rows(), self.doublePrecision)
+            f.close()
+            return
+
         f = open(fileName, 'w')
-        for key,value in self.header.iteritems():
+        for key,value in self.header.items():
             f.write(str(key)+'> '+ str(value) + '\n')
+        f.write(_ColumnLine(self.columns, self.doublePrecision))
+        _WriteRows(f, self._Rows(), self.doublePrecision)
+        f.close()
 
-        if self.doublePrecision:
-            colStrings = map(lambda s: '%23s' % s, self.columns)
-        else:
-            colStrings = map(lambda s: '%14s' % s, self.columns)
-        colStrings[0] = colStrings[0].strip() # don't pad the first column title
-        # a '!' denotes the column header line
-        f.write('! '+ '\t'.join(colStrings)+'\n')
-        
+    def _Rows(self):
+        """
+        The data as a 2D array of rows in the file order.
+        """
         # flatten all but last dimension - 3 field components
         nvalues = _np.shape(self.data)[-1] # number of values in last dimension
 
@@ -38,24 +134,63 @@ class Field(object):
             # [x,values]       -> [x,values]       for 1D
             if (self.data.ndim == 2):
                 pass # do nothin for 1D
-            inds = range(self.data.ndim)       # indices for dimension [0,1,2] etc
+            inds = list(range(self.data.ndim)) # indices for dimension [0,1,2] etc
             # keep the last value the same but reverse all indices before then
             inds[:(self.data.ndim - 1)] = reversed(inds[:(self.data.ndim - 1)])
             datal = _np.transpose(self.data, inds)
         else:
             datal = self.data
 
-        datal = datal.reshape(-1,nvalues)
-        for value in datal:
-            if self.doublePrecision:
-                strings   = map(lambda x: '%.16E' % x, value)
-                stringsFW = map(lambda s: '%23s' % s,  strings)
-            else:
-                strings   = map(lambda x: '%.8E' % x, value)
-                stringsFW = map(lambda s: '%14s' % s, strings)
-            f.write('\t'.join(stringsFW) + '\n')
+        return datal.reshape(-1,nvalues)
 
-        f.close()
+
+def _ColumnLine(columns, doublePrecision):
+    """
+    The '!' column header line with the column names aligned to the values.
+    """
+    if doublePrecision:
+        colStrings = ['%23s' % s for s in columns]
+    else:
+        colStrings = ['%14s' % s for s in columns]
+    colStrings[0] = colStrings[0].strip() # don't pad the first column title
+    # a '!' denotes the column header line
+    return '! '+ '\t'.join(colStrings)+'\n'
+
+def _PadColumnLine(line, offset):
+    """
+    Pad the column line with trailing spaces so the binary values that follow
+    it start at a multiple of 64 bytes from the start of the file.
+    """
+    end = offset + len(line)
+    return line[:-1] + ' '*(-end % 64) + '\n'
+
+def _BinaryDtype(doublePrecision):
+    if doublePrecision:
+        return _np.dtype('<f8')
+    else:
+        return _np.dtype('<f4')
+
+def _WriteRows(f, rows, doublePrecision):
+    """
+    Write a 2D array of rows as text to open file f.
+    """
+    # each value is '%.8E' right aligned in 14 characters ('%.16E' in 23
+    # for double precision) - format a block of rows at a time rather
+    # than value by value.
+    for start in range(0, len(rows), _WRITEBLOCKROWS):
+        block = rows[start:start+_WRITEBLOCKROWS]
+        if doublePrecision:
+            f.write(_FormatRows(block, '%23.16E'))
+        else:
+            f.write(_FormatRowsSingle(block))
+
+def _WriteBinaryRows(f, rows, doublePrecision):
+    """
+    Write a 2D array of rows as raw little endian values to open file f.
+    """
+    dtype = _BinaryDtype(doublePrecision)
+    for start in range(0, len(rows), _WRITEBLOCKROWS):
+        f.write(_np.ascontiguousarray(rows[start:start+_WRITEBLOCKROWS], dtype=dtype).tobytes())
 
 
 class Field1D(Field):
@@ -0,0 +1,74 @@
+import math as _math
+import numpy as _np
+
+from ._Interpolator import Interpolator
+
+def Harmonics(field, radius, nmax, nsamples=128, method='cubic', centre=(0.0, 0.0),
+              brho=None, length=1.0, unit=0.01):
+    """
+    Normal and skew multipole harmonics of a 2D field map, or of each z slice
+    of a 3D one, on a circle of the reference radius.
+
+    The field is interpolated at nsamples points on the circle (all z slices
+    in one call) and By + iBx = sum_n (B_n + iA_n) ((x + iy) / radius)^n is
+    decomposed by FFT, with n = 0 the dipole, 1 the quadrupole etc.
+
+    field    - array as returned by Load (2D or 3D), or an Interpolator of one.
+    radius   - reference radius in the map coordinate units.
+    nmax     - highest order returned.
+    centre   - (x,y) of the circle centre in the map coordinate units.
+
+    returns (normal, skew) - arrays of B_n and A_n in the field units at the
+    reference radius, of length nmax+1, or shape (nz, nmax+1) for a 3D map.
+
+    If brho (magnetic rigidity in Tm, field in T) is given, returns
+    (knl, ksl) tuples for Builder.AddMultipole instead, with MAD conventions:
+    By + iBx = brho/L sum_n (knl_n + i ksl_n) (x + iy)^n / n!. They are
+    integrated over z for a 3D map or multiplied by length (m) for a 2D one.
+    unit is the length in m of a map coordinate unit - BDSIM maps are in cm.
+
+    Example::
+
+    >>> f = pybdsim.Field.Load('quadrupole3d.dat')
+    >>> knl, ksl = pybdsim.Field.Harmonics(f, radius=2.0, nmax=5, brho=3.3356)
+    >>> machine.AddMultipole('q1', length=0.5, knl=knl, ksl=ksl)
+
+    """
+    if not isinstance(field, Interpolator):
+        field = Interpolator(field, method, outside='raise')
+    if field.nDim not in (2, 3):
+        raise ValueError('harmonics need a 2D or 3D field map, not ' + str(field.nDim) + 'D')
+    if nsamples < 2*nmax + 2:
+        raise ValueError('nsamples must be at least 2*nmax+2 to resolve order ' + str(nmax))
+
+    theta  = 2*_np.pi*_np.arange(nsamples) / nsamples
+    circle = _np.column_stack([centre[0] + radius*_np.cos(theta),
+                               centre[1] + radius*_np.sin(theta)])
+    if field.nDim == 3:
+        z      = field.mins[2] + field.steps[2]*_np.arange(field.shape[2])
+        points = _np.column_stack([_np.tile(circle, (len(z), 1)), _np.repeat(z, nsamples)])
+    else:
+        points = circle
+    b = field(points).reshape(-1, nsamples, field.values.shape[1])
+
+    coefficients = _np.fft.fft(b[...,1] + 1j*b[...,0], axis=-1)[:, :nmax+1] / nsamples
+    normal = coefficients.real
+    skew   = coefficients.imag
+
+    if brho is None:
+        if field.nDim == 2:
+            return normal[0], skew[0]
+        return normal, skew
+
+    # B_n at the radius -> n! b_n L / brho with b_n in T/m^n
+    n     = _np.arange(nmax + 1)
+    scale = _np.array([_math.factorial(i) for i in range(nmax + 1)]) / (brho * (radius*unit)**n)
+    if field.nDim == 3 and len(z) > 1:
+        # trapezium rule over the z slices
+        dz     = _np.diff(z*unit)[:,None]
+        normal = 0.5*_np.sum((normal[1:] + normal[:-1])*dz, axis=0)
+        skew   = 0.5*_np.sum((skew[1:] + skew[:-1])*dz, axis=0)
+    else:
+        normal = normal[0]*length
+        skew   = skew[0]*length
+    return tuple((normal*scale).tolist()), tuple((skew*scale).tolist())
@@ -0,0 +1,179 @@
+import itertools as _itertools
+import numpy as _np
+
+from ._Symmetry import _Normalise
+from ._Symmetry import _Reflect
+
+_BATCHSIZE = 65536 # query points interpolated at a time
+
+class Interpolator(object):
+    """
+    Interpolate a field map array, as returned by Load, at arbitrary points.
+
+    The array has the file order, e.g. (nz,ny,nx,[X,Y,Z,Fx,Fy,Fz]) for 3D. The
+    grid min, max and number of points of each dimension (the xmin, xmax, nx
+    etc. header keys) are taken from its coordinate columns once and then all
+    points are interpolated in vectorised batches.
+
+    method  - 'linear' or 'cubic' (Catmull-Rom, as BDSIM uses).
+    outside - what to return for points outside the grid:
+              'zero'  - zero field, as in BDSIM (default)
+              'nan'   - nan
+              'clip'  - the field at the nearest edge of the grid
+              'raise' - raise a ValueError
+    symmetry - for an array that is only the fundamental domain of a map
+               with mirror symmetry, the symmetry as for SymmetricField.
+               Points are reflected into the fundamental domain and the
+               field components signs applied.
+
+    Example::
+
+    >>> f  = pybdsim.Field.Load('map.dat')
+    >>> fi = pybdsim.Field.Interpolator(f, method='cubic')
+    >>> b  = fi([[0.1, 0.2, 0.3], [0.0, 0.0, 1.2]]) # (x,y,z) -> (fx,fy,fz)
+
+    """
+    def __init__(self, array, method='linear', outside='zero', batchsize=_BATCHSIZE, symmetry=None):
+        if method not in ('linear', 'cubic'):
+            raise ValueError("method must be 'linear' or 'cubic', not " + repr(method))
+        if outside not in ('zero', 'nan', 'clip', 'raise'):
+            raise ValueError("outside must be 'zero', 'nan', 'clip' or 'raise', not " + repr(outside))
+        self.method    = method
+        self.outside   = outside
+        self.batchsize = batchsize
+
+        array     = _np.asarray(array)
+        self.nDim = array.ndim - 1
+        if self.nDim < 1 or self.nDim > 4 or array.shape[-1] <= self.nDim:
+            raise ValueError('array shape ' + str(array.shape) + ' is not a 1D-4D field map')
+
+        self.symmetry = {}
+        if symmetry is not None:
+            self.symmetry = _Normalise(symmetry, self.nDim, array.shape[-1] - self.nDim)
+            # enough reflected grid points for interpolating close to a plane
+            array = _Reflect(array, self.symmetry, self.nDim, layers=2)
+
+        # grid of each coordinate x,y,z,t - the last array axis is x
+        self.header = {}
+        self.mins   = _np.zeros(self.nDim)
+        self.maxs   = _np.zeros(self.nDim)
+        self.steps  = _np.ones(self.nDim)
+        self.shape  = _np.zeros(self.nDim, dtype=int)
+        for d,name in enumerate('xyzt'[:self.nDim]):
+            axis  = self.nDim - 1 - d
+            index = [0]*self.nDim
+            index[axis] = slice(None)
+            line  = array[tuple(index) + (d,)]
+            n     = len(line)
+            self.mins[d]  = line[0]
+            self.maxs[d]  = line[-1]
+            self.shape[d] = n
+            if n > 1:
+                self.steps[d] = (line[-1] - line[0]) / float(n - 1)
+            self.header[name+'min'] = self.mins[d]
+            self.header[name+'max'] = self.maxs[d]
+            self.header['n'+name]   = n
+
+        # flat index strides of the grid for each coordinate
+        self.strides = _np.array([int(_np.prod(self.shape[:d])) for d in range(self.nDim)])
+        self.values  = array.reshape(-1, array.shape[-1])[:, self.nDim:]
+
+    def __call__(self, points):
+        return self.Evaluate(points)
+
+    def Evaluate(self, points):
+        """
+        Interpolate the field at points - an array of shape (N, nDim) with
+        the coordinates in x,y,z,t order, or a single point (for 1D, also N
+        x values). Returns an array of shape (N, ncomponents), or
+        (ncomponents,) for a single point.
+        """
+        points = _np.asarray(points, dtype=float)
+        single = points.ndim == 0 or (points.ndim == 1 and self.nDim > 1)
+        if self.nDim == 1 and points.ndim < 2:
+            points = points.reshape(-1,1) # N values of x
+        points = _np.atleast_2d(points)
+        if points.shape[-1] != self.nDim:
+            raise ValueError('points must have ' + str(self.nDim) + ' coordinates, not ' + str(points.shape[-1]))
+
+        result = _np.empty((len(points), self.values.shape[1]))
+        for start in range(0, len(points), self.batchsize):
+            stop = start + self.batchsize
+            result[start:stop] = self._Evaluate(points[start:stop])
+        if single:
+            return result[0]
+        return result
+
+    def _Evaluate(self, points):
+        signs = None
+        if self.symmetry:
+            points = points.copy()
+            signs  = _np.ones((len(points), self.values.shape[1]))
+            for d,s in self.symmetry.items():
+                negative = points[:,d] < 0
+                points[negative,d] *= -1
+                signs[negative]    *= s
+
+        u = (points - self.mins) / self.steps # fractional grid index
+        last = self.shape - 1
+        with _np.errstate(invalid='ignore'):
+            outside = ((u < -1e-9) | (u > last + 1e-9) | _np.isnan(u)).any(axis=1)
+        if outside.any():
+            if self.outside == 'raise':
+                raise ValueError(str(int(outside.sum())) + ' points are outside the field map')
+            u = _np.clip(_np.nan_to_num(u), 0, last)
+        else:
+            u = _np.clip(u, 0, last)
+
+        indices, weights = _Weights(u, last, self.method)
+        indices = indices*self.strides # flat index for each coordinate
+
+        result = _np.zeros((len(points), self.values.shape[1]))
+        for corner in _itertools.product(range(len(indices)), repeat=self.nDim):
+            index  = indices[corner[0],:,0]
+            weight = weights[corner[0],:,0]
+            for d in range(1, self.nDim):
+                index  = index + indices[corner[d],:,d]
+                weight = weight * weights[corner[d],:,d]
+            result += weight[:,None] * self.values[index]
+
+        if signs is not None:
+            result *= signs
+        if outside.any() and self.outside != 'clip':
+            result[outside] = 0 if self.outside == 'zero' else _np.nan
+        return result
+
+
+def _Weights(u, last, method):
+    """
+    Grid indices and weights of the neighbouring grid points for fractional
+    grid indices u (npoints, nDim) within grids with last index last (nDim).
+    Returns two arrays of shape (noffsets, npoints, nDim) - 2 neighbours for
+    'linear' or 4 for 'cubic' interpolation.
+    """
+    i = _np.minimum(_np.floor(u).astype(int), _np.maximum(last - 1, 0))
+    t = u - i
+    if method == 'linear':
+        offsets = (0, 1)
+        weights = [1 - t, t]
+    else:
+        offsets = (-1, 0, 1, 2)
+        t2 = t*t
+        t3 = t2*t
+        weights = [0.5*(-t3 + 2*t2 - t),
+                   0.5*(3*t3 - 5*t2 + 2),
+                   0.5*(-3*t3 + 4*t2 + t),
+                   0.5*(t3 - t2)]
+        # beyond the edges use points extrapolated linearly from the last
+        # two, i.e. fold their weight onto those
+        low  = i == 0
+        high = i >= last - 1
+        weights[1] = weights[1] + _np.where(low, 2*weights[0], 0)
+        weights[2] = weights[2] - _np.where(low, weights[0], 0)
+        weights[0] = _np.where(low, 0, weights[0])
+        weights[2] = weights[2] + _np.where(high, 2*weights[3], 0)
+        weights[1] = weights[1] - _np.where(high, weights[3], 0)
+        weights[3] = _np.where(high, 0, weights[3])
+
+    indices = _np.array([_np.clip(i + o, 0, last) for o in offsets])
+    return indices, _np.array(weights)
@@ -1,6 +1,17 @@
 import numpy as _np
 import tarfile as _tarfile
 
+from ._Field import _BinaryDtype
+from ._Field import _ColumnLine
+from ._Field import _PadColumnLine
+from ._Field import _WRITEBLOCKROWS
+from ._Field import _WriteBinaryRows
+from ._Field import _WriteRows
+from ._Symmetry import SymmetricField
+from ._Symmetry import _Reflect
+
+_BLOCKSIZE = 1024*1024 # bytes of the numeric body parsed at a time
+
 def Load(filename, debug=False):
     """
     Load a BDSIM field format file into a numpy array. Can either
@@ -9,25 +20,174 @@ def Load(filename, debug=False):
 
     returns a numpy array with the corresponding number of dimensions
     and the dimension has the coordaintes and fx,fy,fz.
+
+    Binary field maps (see Field.Write(binary=True)) are memory mapped, so
+    the array is paged in from the file as it is used. Compressed binary
+    files are read into memory.
+
+    Maps written as only their fundamental domain (see SymmetricField) are
+    reconstructed in full - use LoadSymmetric to keep only the fundamental
+    domain.
+    """
+    data, header = _Load(filename, debug)
+    symmetry = _Symmetry(header, data)
+    if symmetry:
+        data = _Reflect(data, symmetry, data.ndim - 1)
+    return data
+
+def LoadSymmetric(filename, debug=False):
+    """
+    Load a BDSIM field map written as only its fundamental domain by
+    SymmetricField.Write(full=False) as a SymmetricField.
+    """
+    data, header = _Load(filename, debug)
+    symmetry = _Symmetry(header, data)
+    if not symmetry:
+        raise ValueError(filename + ' has no mirrorx, mirrory or mirrorz header keys')
+    return SymmetricField(data, symmetry, fundamental=True)
+
+def _Symmetry(header, data):
+    """
+    The mirror symmetries from the 'mirrorx' etc. header keys, whose values
+    have bit i set if field component i changes sign in the mirror image.
+    """
+    symmetry = {}
+    if data is None:
+        return symmetry
+    nComponents = data.shape[-1] - (data.ndim - 1)
+    for d,name in enumerate('xyz'):
+        if 'mirror'+name in header:
+            odd = int(header['mirror'+name])
+            symmetry[d] = [-1 if odd & 2**i else 1 for i in range(nComponents)]
+    return symmetry
+
+def _Load(filename, debug=False):
+    """
+    Load a BDSIM field map as it is in the file - returns the array (None if
+    it isn't valid) and the header.
     """
     if (filename.endswith('.tar.gz')):
         print('Field Loader> loading compressed file ' + filename)
-        tar = _tarfile.open(filename,'r')
-        f = tar.extractfile(tar.firstmember)
     else:
         print('Field Loader> loading file ' + filename)
-        f = open(filename)
-
-    intoData = False
-    header   = {}
-    columns  = []
-    data     = []
-    
-    for line in f:
-        if intoData:
-            data.append(line.strip().split())
-
-        elif '>' in line:
+    f, tar = _Open(filename)
+
+    try:
+        header, columns, lines = _ReadHeader(f)
+
+        nDim = len(columns) - 3
+        if (nDim < 1 or nDim > 4):
+            if debug:
+                print('Invalid number of columns')
+                print(columns)
+            return None, header
+
+        required = ['nx','ny','nz','nt']
+
+        requiredKeys    = required[:nDim]
+        requiredKeysSet = set(requiredKeys)
+        if not requiredKeysSet.issubset(header.keys()):
+            print('missing keys from header!')
+            if debug:
+                print(header)
+            return None, header
+
+        dims = [int(header[k]) for k in requiredKeys[::-1]]
+        dims.append(len(columns))
+        if debug:
+            print(dims)
+            print(nDim)
+        if 'binary' in header:
+            data = _ReadBinaryBody(f, tar, filename, dims, header)
+        else:
+            data = _ReadBody(f, dims)
+    finally:
+        f.close()
+        if tar is not None:
+            tar.close()
+
+    return data, header
+
+def ConvertToBinary(filename, outputfilename, doublePrecision=True):
+    """
+    Convert a text BDSIM field map to the binary format that Load memory
+    maps. The header is kept as it is and the body is converted a block at
+    a time, so the map is never held in memory as a whole.
+
+    The text has 9 significant digits (17 if written in double precision) so
+    doublePrecision=False halves the size at the cost of about 2 digits.
+    """
+    f, tar = _Open(filename)
+    out = open(outputfilename, 'wb')
+    try:
+        header, columns, lines = _ReadHeader(f)
+        if 'binary' in header:
+            raise ValueError(filename + ' is already a binary field map')
+        text = ''.join(lines[:-1])
+        text += 'binary> ' + str(_BinaryDtype(doublePrecision).itemsize) + '\n'
+        text += _PadColumnLine(lines[-1].rstrip('\r\n') + '\n', len(text))
+        out.write(text.encode('latin-1'))
+        for tokens in _BodyBlocks(f):
+            _WriteBinaryRows(out, _np.array(tokens, dtype=float)[None,:], doublePrecision)
+    finally:
+        out.close()
+        f.close()
+        if tar is not None:
+            tar.close()
+
+def ConvertToText(filename, outputfilename, doublePrecision=None):
+    """
+    Convert a binary BDSIM field map back to the text format. By default the
+    values are written in double precision if they are stored as float64.
+    """
+    f, tar = _Open(filename)
+    try:
+        header, columns, lines = _ReadHeader(f)
+    finally:
+        f.close()
+        if tar is not None:
+            tar.close()
+    if 'binary' not in header:
+        raise ValueError(filename + ' is not a binary field map')
+    if doublePrecision is None:
+        doublePrecision = int(header['binary']) == 8
+
+    data, header = _Load(filename)
+    out  = open(outputfilename, 'w')
+    for line in lines[:-1]:
+        if line.split('>')[0].strip() != 'binary':
+            out.write(line.rstrip('\r\n') + '\n')
+    out.write(_ColumnLine(columns, doublePrecision))
+    rows = data.reshape(-1, len(columns))
+    for start in range(0, len(rows), _WRITEBLOCKROWS):
+        _WriteRows(out, _np.array(rows[start:start+_WRITEBLOCKROWS], dtype=float), doublePrecision)
+    out.close()
+
+def _Open(filename):
+    """
+    Open a field map for reading in binary mode - returns the file and the
+    tarfile it is streamed from (None for a regular file).
+    """
+    if (filename.endswith('.tar.gz')):
+        tar = _tarfile.open(filename,'r')
+        f = tar.extractfile(tar.firstmember) # streamed - not extracted in memory
+        return f, tar
+    else:
+        return open(filename, 'rb'), None
+
+def _ReadHeader(f):
+    """
+    Read the 'key> value' header lines and the '!' column line from a field
+    map file opened in binary mode, leaving f at the start of the body.
+    Returns the header, the column names and the text of the lines read.
+    """
+    header  = {}
+    columns = []
+    lines   = []
+    for line in iter(f.readline, b''):
+        line = line.decode('latin-1') # any byte - comments needn't be ascii
+        lines.append(line)
+        if '>' in line:
             d = line.strip().split('>')
             k = d[0].strip()
             v = float(d[1].strip())
@@ -35,35 +195,146 @@ def Load(filename, debug=False):
 
         elif '!' in line:
             columns = line.strip('!').strip().split()
-            intoData = True
+            break
+    return header, columns, lines
+
+def _BodyBlocks(f):
+    """
+    Yield the whitespace separated numbers of a text body as lists of tokens,
+    a block of text at a time.
+    """
+    rest = b''
+    while True:
+        block = f.read(_BLOCKSIZE)
+        if not block:
+            yield rest.split()
+            return
+        block = rest + block
+        end   = max(block.rfind(b'\n'), block.rfind(b' '), block.rfind(b'\t'))
+        if end < 0:
+            rest = block
+            continue
+        yield block[:end].split()
+        rest = block[end:]
+
+def _ReadBody(f, dims):
+    """
+    Parse the numbers of a text body straight into a preallocated array of
+    shape dims.
+    """
+    data = _np.empty(int(_np.prod(dims)), dtype=float)
+    n    = 0
+    for tokens in _BodyBlocks(f):
+        if n + len(tokens) > len(data):
+            raise ValueError('more values in field map than its header nx,ny,nz,nt and columns give')
+        data[n:n+len(tokens)] = tokens
+        n += len(tokens)
+    if n != len(data):
+        raise ValueError('field map has ' + str(n) + ' values but its header nx,ny,nz,nt and columns give ' + str(len(data)))
+    return data.reshape(*dims)
 
-    f.close()
+def _ReadBinaryBody(f, tar, filename, dims, header):
+    """
+    Memory map the raw values of a binary body with shape dims, or read them
+    into memory if the file is compressed.
+    """
+    size = int(header['binary'])
+    if size not in (4, 8):
+        raise ValueError('binary field map values must be 4 or 8 bytes, not ' + str(size))
+    dtype = _BinaryDtype(size == 8)
+    count = int(_np.prod(dims))
 
-    data = _np.array(data, dtype=float)
+    if tar is None:
+        offset = f.tell()
+        f.seek(0, 2)
+        if f.tell() - offset != count*dtype.itemsize:
+            raise ValueError('binary field map has ' + str((f.tell() - offset) // dtype.itemsize) + ' values but its header nx,ny,nz,nt and columns give ' + str(count))
+        return _np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=tuple(dims))
 
+    data = _np.empty(count, dtype=dtype)
+    raw  = data.view(_np.uint8)
+    n    = 0
+    while n < len(raw):
+        block = f.read(min(_BLOCKSIZE, len(raw) - n))
+        if not block:
+            break
+        raw[n:n+len(block)] = _np.frombuffer(block, dtype=_np.uint8)
+        n += len(block)
+    if n != len(raw) or f.read(1):
+        raise ValueError('binary field map size does not match its header nx,ny,nz,nt and columns')
+    return data.reshape(*dims)
+
+def _ReadDims(filename):
+    """
+    The header, column names, header lines and array shape of a field map
+    without reading its body.
+    """
+    f, tar = _Open(filename)
+    try:
+        header, columns, lines = _ReadHeader(f)
+    finally:
+        f.close()
+        if tar is not None:
+            tar.close()
     nDim = len(columns) - 3
     if (nDim < 1 or nDim > 4):
-        if debug:
-            print('Invalid number of columns')
-            print(columns)
-        return
+        raise ValueError('invalid number of columns in field map ' + filename)
+    requiredKeys = ['nx','ny','nz','nt'][:nDim]
+    if not set(requiredKeys).issubset(header.keys()):
+        raise ValueError('missing keys ' + str(requiredKeys) + ' from field map header ' + filename)
+    dims = [int(header[k]) for k in requiredKeys[::-1]]
+    dims.append(len(columns))
+    return header, columns, lines, dims
 
-    required = ['nx','ny','nz','nt']
+def _Slabs(filename):
+    """
+    Yield the body of a field map one slab at a time along the outermost
+    loop dimension (z for 3D, t for 4D), each of shape dims[1:], so only one
+    slab is in memory at a time.
+    """
+    header, columns, lines, dims = _ReadDims(filename)
+    f, tar = _Open(filename)
+    try:
+        _ReadHeader(f)
+        slabSize = int(_np.prod(dims[1:]))
+        if 'binary' in header and tar is None:
+            data = _ReadBinaryBody(f, tar, filename, dims, header)
+            for slab in data:
+                yield slab
+            return
 
-    requiredKeys    = required[:nDim]
-    requiredKeysSet = set(requiredKeys)
-    if not requiredKeysSet.issubset(header.keys()):
-        print('missing keys from header!')
-        if debug:
-            print(header)
-        return
-    else:
-        dims = [int(header[k]) for k in requiredKeys[::-1]]
-        dims.append(len(columns))
-        if debug:
-            print(dims)
-            print(nDim)
-            print(_np.shape(data))
-        data = data.reshape(*dims)
+        if 'binary' in header:
+            dtype = _BinaryDtype(int(header['binary']) == 8)
+            def Blocks():
+                while True:
+                    block = f.read(_BLOCKSIZE - _BLOCKSIZE % dtype.itemsize)
+                    if not block:
+                        return
+                    yield _np.frombuffer(block, dtype=dtype)
+        else:
+            def Blocks():
+                for tokens in _BodyBlocks(f):
+                    yield _np.array(tokens, dtype=float)
 
-    return data
+        slab  = _np.empty(slabSize)
+        n     = 0
+        nSlab = 0
+        for values in Blocks():
+            while len(values) > 0:
+                if nSlab == dims[0]:
+                    raise ValueError('more values in field map than its header nx,ny,nz,nt and columns give')
+                k = min(len(values), slabSize - n)
+                slab[n:n+k] = values[:k]
+                values = values[k:]
+                n += k
+                if n == slabSize:
+                    yield slab.reshape(dims[1:])
+                    slab  = _np.empty(slabSize)
+                    n     = 0
+                    nSlab += 1
+        if nSlab != dims[0] or n != 0:
+            raise ValueError('field map has fewer values than its header nx,ny,nz,nt and columns give')
+    finally:
+        f.close()
+        if tar is not None:
+            tar.close()
@@ -0,0 +1,77 @@
+import numpy as _np
+
+from ._Interpolator import Interpolator
+
+def PathIntegrals(field, paths, vector=False, method='linear', outside='zero', unit=0.01):
+    """
+    Field integrals along many trajectories through a 3D (or 4D) field map,
+    evaluating the map at the points of all of them in one interpolation.
+
+    field   - array as returned by Load, or an Interpolator of one.
+    paths   - a list of N arrays of points (M_i, 3) (x,y,z in the map units,
+              plus t for a 4D map) along each trajectory, e.g. polylines or
+              sampler / trajectory output, or one array of shape (N, M, 3).
+    vector  - if False, integrate B.dl. If True, integrate each component
+              of the field along the path length, i.e. (int Bx dl, int By dl,
+              int Bz dl), as for kicker and corrector strengths.
+    outside - as for Interpolator - points outside the map have zero field
+              by default.
+    unit    - length in m of a map coordinate unit - BDSIM maps are in cm.
+
+    Each segment between consecutive points contributes the mean field at its
+    ends times its length (trapezium rule).
+
+    returns (integrals, segments) - integrals is an array of shape (N,), or
+    (N,3) with vector=True, in field units x m. segments holds the
+    contribution of each segment of each path - a list of arrays of length
+    M_i - 1, or one array of shape (N, M-1) if paths was one array.
+
+    Example::
+
+    >>> f = pybdsim.Field.Load('kicker3d.dat')
+    >>> z = np.linspace(-50, 50, 201)
+    >>> paths = [np.column_stack([np.full_like(z, x0), np.zeros_like(z), z]) for x0 in (-1,0,1)]
+    >>> integrals, segments = pybdsim.Field.PathIntegrals(f, paths, vector=True)
+
+    """
+    if not isinstance(field, Interpolator):
+        field = Interpolator(field, method, outside)
+    if field.nDim < 3 or field.values.shape[1] < 3:
+        raise ValueError('path integrals need a 3D or 4D field map with 3 field components')
+
+    regular = isinstance(paths, _np.ndarray) and paths.ndim == 3
+    paths   = [_np.asarray(p, dtype=float) for p in paths]
+    if len(paths) == 0:
+        return _np.zeros((0, 3) if vector else 0), []
+    for p in paths:
+        if p.ndim != 2 or p.shape[1] != field.nDim or len(p) == 0:
+            raise ValueError('each path must be an array of one or more points with ' + str(field.nDim) + ' coordinates')
+    lengths = _np.array([len(p) for p in paths], dtype=int)
+    points  = _np.concatenate(paths)
+
+    b  = field(points)[:, :3]
+    dl = _np.diff(points[:, :3], axis=0) * unit
+    bm = 0.5*(b[1:] + b[:-1])
+
+    # drop the segments joining the end of one path to the start of the next
+    keep = _np.ones(len(dl), dtype=bool)
+    keep[_np.cumsum(lengths)[:-1] - 1] = False
+    dl = dl[keep]
+    bm = bm[keep]
+
+    if vector:
+        contributions = bm * _np.sqrt(_np.sum(dl*dl, axis=1))[:,None]
+    else:
+        contributions = _np.sum(bm*dl, axis=1)
+
+    nSegments = _np.maximum(lengths - 1, 0)
+    pathIndex = _np.repeat(_np.arange(len(paths)), nSegments)
+    if vector:
+        integrals = _np.column_stack([_np.bincount(pathIndex, contributions[:,i], minlength=len(paths)) for i in range(3)])
+    else:
+        integrals = _np.bincount(pathIndex, contributions, minlength=len(paths))
+
+    segments = _np.split(contributions, _np.cumsum(nSegments)[:-1])
+    if regular:
+        segments = _np.array(segments)
+    return integrals, segments
@@ -0,0 +1,137 @@
+import numpy as _np
+
+from ._Field import _BinaryDtype
+from ._Field import _ColumnLine
+from ._Field import _PadColumnLine
+from ._Field import _WriteBinaryRows
+from ._Field import _WriteRows
+from ._Interpolator import _Weights
+from ._Loader import _ReadDims
+from ._Loader import _Slabs
+
+def Resample(filename, outputfilename, limits=None, decimate=None, n=None,
+             method='linear', binary=False, doublePrecision=False):
+    """
+    Crop, decimate and / or resample a BDSIM field map (text, binary or
+    .tar.gz) and write the result to outputfilename.
+
+    limits   - dict of coordinate ranges to crop to, e.g. {'x':(-0.1,0.1), 'z':(0,2)}.
+               Grid points within each range are kept.
+    decimate - dict of every how many grid points to keep, e.g. {'x':2, 'y':2}
+    n        - dict of numbers of evenly spaced points to resample to across
+               the (cropped) range, e.g. {'z':51}. Values are interpolated
+               with method 'linear' or 'cubic' as in Interpolator.
+    binary   - write the binary format rather than text (see Field.Write).
+
+    The map is read and written one slab at a time along the outermost loop
+    dimension (z for 3D, t for 4D), so only a few slabs are in memory at once.
+
+    Example::
+
+    >>> pybdsim.Field.Resample('dense.dat', 'coarse.dat', limits={'x':(-0.05,0.05)},
+                               decimate={'x':2,'y':2}, n={'z':101})
+
+    """
+    limits   = limits or {}
+    decimate = decimate or {}
+    n        = n or {}
+    if method not in ('linear', 'cubic'):
+        raise ValueError("method must be 'linear' or 'cubic', not " + repr(method))
+
+    header, columns, lines, dims = _ReadDims(filename)
+    nDim  = len(dims) - 1
+    names = 'xyzt'[:nDim]
+    for key in list(limits) + list(decimate) + list(n):
+        if key not in names:
+            raise ValueError('no ' + repr(key) + ' dimension in a ' + str(nDim) + 'D field map')
+
+    # output grid of each coordinate as input grid indices and weights
+    newHeader = {}
+    axes      = []
+    for d,name in enumerate(names):
+        vmin  = header[name+'min']
+        count = int(header['n'+name])
+        step  = (header[name+'max'] - vmin) / float(count - 1) if count > 1 else 1.0
+        lo, hi = limits.get(name, (vmin, header[name+'max']))
+        i0 = max(int(_np.ceil((lo - vmin) / step - 1e-9)), 0)
+        i1 = min(int(_np.floor((hi - vmin) / step + 1e-9)), count - 1)
+        if i1 < i0:
+            raise ValueError('no ' + name + ' grid points within ' + str((lo, hi)))
+
+        if name in decimate and name in n:
+            raise ValueError('decimate and n given for ' + repr(name))
+        elif name in n:
+            u = _np.linspace(i0, i1, int(n[name]))
+            indices, weights = _Weights(u[:,None], _np.array([count - 1]), method)
+            indices = indices[:,:,0].T # (nout, noffsets)
+            weights = weights[:,:,0].T
+        else:
+            u = _np.arange(i0, i1 + 1, int(decimate.get(name, 1)))
+            indices = u[:,None]
+            weights = _np.ones((len(u), 1))
+        axes.append((indices, weights))
+        newHeader[name+'min'] = vmin + u[0]*step
+        newHeader[name+'max'] = vmin + u[-1]*step
+        newHeader['n'+name]   = len(u)
+
+    out  = open(outputfilename, 'wb' if binary else 'w')
+    text = ''
+    for line in lines[:-1]:
+        key = line.split('>')[0].strip()
+        if key == 'binary':
+            continue
+        elif key in newHeader:
+            text += key + '> ' + str(newHeader[key]) + '\n'
+        else:
+            text += line.rstrip('\r\n') + '\n'
+    if binary:
+        text += 'binary> ' + str(_BinaryDtype(doublePrecision).itemsize) + '\n'
+        text += _PadColumnLine(_ColumnLine(columns, doublePrecision), len(text))
+        out.write(text.encode('latin-1'))
+    else:
+        out.write(text + _ColumnLine(columns, doublePrecision))
+
+    # slabs along the outermost axis - keep only those the next output slab
+    # needs, each already resampled along the inner axes
+    outerIndices, outerWeights = axes[-1]
+    needed = set(outerIndices.ravel().tolist())
+    slabs  = _Slabs(filename)
+    window = {}
+    nRead  = 0
+    try:
+        for k in range(len(outerIndices)):
+            while max(outerIndices[k]) not in window:
+                slab = next(slabs)
+                if nRead in needed:
+                    window[nRead] = _ResampleSlab(slab, axes[:-1])
+                nRead += 1
+            for i in list(window):
+                if i < min(outerIndices[k]):
+                    del window[i]
+            result = 0
+            for i,w in zip(outerIndices[k], outerWeights[k]):
+                result = result + w*window[i]
+            rows = _np.reshape(result, (-1, len(columns)))
+            if binary:
+                _WriteBinaryRows(out, rows, doublePrecision)
+            else:
+                _WriteRows(out, rows, doublePrecision)
+    finally:
+        slabs.close()
+        out.close()
+
+def _ResampleSlab(slab, axes):
+    """
+    Apply the (indices, weights) of each inner coordinate x,y,.. to a slab.
+    """
+    slab = _np.asarray(slab, dtype=float)
+    nDim = len(axes)
+    for d,(indices, weights) in enumerate(axes):
+        axis   = nDim - 1 - d
+        shape  = [1]*slab.ndim
+        shape[axis] = len(indices)
+        result = 0
+        for o in range(indices.shape[1]):
+            result = result + weights[:,o].reshape(shape) * _np.take(slab, indices[:,o], axis=axis)
+        slab = result
+    return slab
@@ -0,0 +1,224 @@
+import numpy as _np
+
+from ._Field import _BinaryDtype
+from ._Field import _ColumnLine
+from ._Field import _PadColumnLine
+from ._Field import _WriteBinaryRows
+from ._Field import _WriteRows
+
+# sign of (Fx,Fy,Fz) at the mirror image of a point in each plane
+_SYMMETRIES = {
+    'dipole'     : {'x' : (-1, 1, 1), 'y' : (-1, 1,-1)},
+    'quadrupole' : {'x' : ( 1,-1,-1), 'y' : (-1, 1,-1)},
+}
+
+class SymmetricField(object):
+    """
+    A field map with mirror symmetry in x, y and / or z that only stores the
+    fundamental domain (1/2, 1/4 or 1/8 of the map) and reconstructs the rest
+    on demand.
+
+    array       - field map array as returned by Load, in file order.
+    symmetry    - 'dipole', 'quadrupole' or a dict of the sign of each field
+                  component at the mirror image of a point for each mirror
+                  plane, e.g. {'x':(-1,1,1), 'z':(1,1,-1)}. If None, it is
+                  found from the array with DetectSymmetry.
+    fundamental - if True the array is already only the fundamental domain,
+                  i.e. the coordinates are >= 0 in each mirrored dimension.
+
+    Example::
+
+    >>> f = pybdsim.Field.Load('dipole.dat')
+    >>> s = pybdsim.Field.SymmetricField(f, 'dipole')
+    >>> s.Write('dipole_quarter.dat', full=False) # 1/4 of the size on disk
+    >>> b = s.Interpolator()([[-0.01, -0.02, 0.3]])
+
+    """
+    def __init__(self, array, symmetry=None, fundamental=False, tolerance=1e-6):
+        array = _np.asarray(array)
+        self.nDim = array.ndim - 1
+        if symmetry is None:
+            symmetry = DetectSymmetry(array, tolerance)
+        self.symmetry = _Normalise(symmetry, self.nDim, array.shape[-1] - self.nDim)
+        if fundamental:
+            self.data = array
+        else:
+            self.data = _Fundamental(array, self.symmetry, tolerance)
+
+    def Full(self):
+        """
+        The whole field map array reconstructed from the fundamental domain.
+        """
+        return _Reflect(self.data, self.symmetry, self.nDim)
+
+    def Interpolator(self, method='linear', outside='zero'):
+        """
+        An Interpolator for the whole map that only reflects the query points
+        into the fundamental domain rather than reconstructing the map.
+        """
+        from ._Interpolator import Interpolator
+        return Interpolator(self.data, method, outside, symmetry=self.symmetry)
+
+    def Write(self, fileName, full=True, binary=False, doublePrecision=False):
+        """
+        Write the field map in BDSIM field format. With full=True the whole
+        map is written, reconstructing it a slab at a time along the outermost
+        loop dimension. With full=False only the fundamental domain is written
+        with 'mirrorx' etc. header keys that Load uses to reconstruct it.
+        """
+        nDim    = self.nDim
+        columns = ['X','Y','Z','T'][:nDim] + ['Fx','Fy','Fz','Fw'][:self.data.shape[-1] - nDim]
+
+        header = []
+        for d,name in enumerate('xyzt'[:nDim]):
+            coords = _Coordinates(self.data, d, nDim)
+            vmin   = coords[0]
+            n      = len(coords)
+            if full and d in self.symmetry:
+                vmin = -coords[-1]
+                n    = 2*n - 1 if _np.isclose(coords[0], 0, atol=1e-12) else 2*n
+            header.append((name+'min', vmin))
+            header.append((name+'max', coords[-1]))
+            header.append(('n'+name, n))
+        if not full:
+            for d in sorted(self.symmetry):
+                odd = sum([2**i for i,s in enumerate(self.symmetry[d]) if s < 0])
+                header.append(('mirror'+'xyzt'[d], odd))
+
+        text = ''.join([str(key)+'> '+ str(value) + '\n' for key,value in header])
+        if binary:
+            f = open(fileName, 'wb')
+            text += 'binary> ' + str(_BinaryDtype(doublePrecision).itemsize) + '\n'
+            text += _PadColumnLine(_ColumnLine(columns, doublePrecision), len(text))
+            f.write(text.encode('ascii'))
+        else:
+            f = open(fileName, 'w')
+            f.write(text + _ColumnLine(columns, doublePrecision))
+
+        if full:
+            slabs = self._Slabs()
+        else:
+            slabs = iter(self.data)
+        for slab in slabs:
+            rows = _np.reshape(slab, (-1, self.data.shape[-1]))
+            if binary:
+                _WriteBinaryRows(f, rows, doublePrecision)
+            else:
+                _WriteRows(f, rows, doublePrecision)
+        f.close()
+
+    def _Slabs(self):
+        """
+        Yield the whole map one slab at a time along the outermost axis.
+        """
+        outer  = self.nDim - 1
+        inner  = dict([(d,s) for d,s in self.symmetry.items() if d != outer])
+        if outer in self.symmetry:
+            # mirror image of the fundamental domain in the outer plane, in
+            # reverse order and without the plane itself, one slab at a time
+            signs  = self.symmetry[outer]
+            coords = _Coordinates(self.data, outer, self.nDim)
+            stop   = 0 if _np.isclose(coords[0], 0, atol=1e-12) else -1
+            for i in range(len(self.data) - 1, stop, -1):
+                slab = _np.array(self.data[i], dtype=float)
+                slab[..., outer] *= -1
+                slab[..., slab.shape[-1] - len(signs):] *= signs
+                yield _Reflect(slab, inner, self.nDim - 1)
+        for slab in self.data:
+            yield _Reflect(slab, inner, self.nDim - 1)
+
+
+def DetectSymmetry(array, tolerance=1e-6):
+    """
+    Find the mirror symmetries of a whole field map array (as returned by
+    Load). Returns a dict of the sign of each field component at the mirror
+    image of a point for each plane x=0, y=0, z=0 the map is symmetric in,
+    e.g. {'x':(-1,1,1), 'y':(-1,1,-1)} for a dipole.
+
+    Components agree within tolerance times their largest magnitude.
+    """
+    array = _np.asarray(array)
+    nDim  = array.ndim - 1
+    found = {}
+    for d in range(min(nDim, 3)):
+        axis   = nDim - 1 - d
+        coords = _Coordinates(array, d, nDim)
+        step   = _np.abs(coords[-1] - coords[0]) / max(len(coords) - 1, 1)
+        if not _np.allclose(coords, -coords[::-1], atol=tolerance*max(step, 1e-300)):
+            continue
+        field   = array[..., nDim:]
+        mirror  = _np.flip(field, axis)
+        signs   = []
+        for c in range(field.shape[-1]):
+            atol = tolerance*_np.abs(field[...,c]).max()
+            if _np.allclose(mirror[...,c], field[...,c], rtol=0, atol=atol):
+                signs.append(1)
+            elif _np.allclose(mirror[...,c], -field[...,c], rtol=0, atol=atol):
+                signs.append(-1)
+            else:
+                break
+        if len(signs) == field.shape[-1]:
+            found['xyz'[d]] = tuple(signs)
+    return found
+
+def _Normalise(symmetry, nDim, nComponents):
+    """
+    Symmetry as a dict of coordinate index to an array of component signs.
+    """
+    if isinstance(symmetry, str):
+        if symmetry not in _SYMMETRIES:
+            raise ValueError('unknown symmetry ' + repr(symmetry) + ' - use one of ' + str(sorted(_SYMMETRIES)) + ' or a dict')
+        symmetry = _SYMMETRIES[symmetry]
+    result = {}
+    for plane,signs in symmetry.items():
+        d = 'xyz'.find(plane) if isinstance(plane, str) else plane
+        if d < 0 or d >= min(nDim, 3):
+            raise ValueError('no ' + repr(plane) + ' mirror plane in a ' + str(nDim) + 'D field map')
+        signs = _np.asarray(signs, dtype=float)
+        if signs.shape != (nComponents,) or not set(_np.abs(signs)) == set([1.0]):
+            raise ValueError('symmetry for ' + repr(plane) + ' needs one sign (1 or -1) per field component')
+        result[d] = signs
+    return result
+
+def _Coordinates(array, d, nDim):
+    """
+    The grid of coordinate d (x,y,z,t) of a field map array.
+    """
+    index = [0]*nDim
+    index[nDim - 1 - d] = slice(None)
+    return _np.asarray(array[tuple(index) + (d,)], dtype=float)
+
+def _Fundamental(array, symmetry, tolerance):
+    """
+    The part of a whole field map array with coordinates >= 0 in each plane.
+    """
+    nDim = array.ndim - 1
+    for d in symmetry:
+        coords = _Coordinates(array, d, nDim)
+        step   = _np.abs(coords[-1] - coords[0]) / max(len(coords) - 1, 1)
+        if not _np.allclose(coords, -coords[::-1], atol=tolerance*step):
+            raise ValueError('the ' + 'xyz'[d] + ' grid is not symmetric about 0')
+        keep  = _np.flatnonzero(coords >= -tolerance*step)
+        array = _np.take(array, keep, axis=nDim - 1 - d)
+    return array
+
+def _Reflect(array, symmetry, nDim, layers=None):
+    """
+    Reflect a fundamental domain array (or a slab of one with nDim inner
+    dimensions) in each plane of symmetry, negating the coordinate and
+    applying the field component signs. Only the first layers grid points
+    next to each plane are reflected if given.
+    """
+    array = _np.asarray(array)
+    for d,signs in symmetry.items():
+        axis   = nDim - 1 - d
+        coords = _Coordinates(array, d, nDim)
+        start  = 1 if _np.isclose(coords[0], 0, atol=1e-12) else 0 # don't repeat x=0
+        stop   = array.shape[axis] if layers is None else min(start + layers, array.shape[axis])
+        index  = [slice(None)]*array.ndim
+        index[axis] = slice(start, stop)
+        mirror = _np.flip(array[tuple(index)], axis).astype(float)
+        mirror[..., d] *= -1
+        mirror[..., array.shape[-1] - len(signs):] *= signs
+        array = _np.concatenate([mirror, array], axis=axis)
+    return array
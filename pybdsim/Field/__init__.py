@@ -9,6 +9,20 @@ from ._Field import Field3D
 from ._Field import Field4D
 
 from ._Loader import Load
+from ._Loader import ConvertToBinary
+from ._Loader import ConvertToText
+from ._Loader import LoadSymmetric
+
+from ._Interpolator import Interpolator
+
+from ._Harmonics import Harmonics
+
+from ._PathIntegrals import PathIntegrals
+
+from ._Resample import Resample
+
+from ._Symmetry import DetectSymmetry
+from ._Symmetry import SymmetricField
 
 from .FieldPlotter import Plot2DXY
 from .FieldPlotter import Plot3DXY
@@ -47,34 +47,56 @@ class Analysis:
         1.202: similar but different number of particles maybe
         ... etc
         """
-        self.datagrouped = Data.AsciiData()
-        
-        #find unique values of variable
-        uniquevalues = sorted(list(set(_np.round(self.data[variable],2))))
-
-        #remove the variable from the subset
-        #find it's index in keys list
-        indexofvariabletoremove = self.keyslist.index(variable)
-        for value in uniquevalues:
-            mask      = _np.round(self.data[variable],2) == value
-            dcopy     = self.dataarray[mask]
+        #find unique values of variable and the group of each entry, then
+        #sort the data once so each group is a contiguous block
+        uniquevalues, inverse = _np.unique(_np.round(self.data[variable],2), return_inverse=True)
+        inverse = inverse.ravel()
+        self._groupinverse = inverse
+        self._groupcounts  = _np.bincount(inverse, minlength=len(uniquevalues))
+        order  = _np.argsort(inverse, kind='mergesort')
+        groups = _np.split(self.dataarray[order], _np.cumsum(self._groupcounts)[:-1])
+
+        self.datagrouped = {}
+        for value,dcopy in zip(uniquevalues,groups):
             dcopydict = dict(zip(self.keyslist,[dcopy[:,i] for i in range(_np.shape(dcopy)[1])]))
-
-            #dcopydict = Data.AsciiData(zip(self.data.keyslist,[dcopy[:,i] for i in range(_np.shape(dcopy)[1])]))
             dcopydict['nparticles'] = _np.shape(dcopy)[0]
             self.datagrouped[value] = dcopydict
-        self.keysgrouped = list(_np.sort(self.datagrouped.keys()))
+        self.keysgrouped = list(uniquevalues)
+
+    def GroupCount(self):
+        """
+        Number of entries in each group of GroupBy, in the order of keysgrouped.
+        """
+        if hasattr(self,'datagrouped') == False:
+            self.GroupBy()
+        return self._groupcounts.copy()
+
+    def GroupMean(self,variable):
+        """
+        Mean of variable in each group of GroupBy, in the order of keysgrouped.
+        """
+        if hasattr(self,'datagrouped') == False:
+            self.GroupBy()
+        sums = _np.bincount(self._groupinverse, weights=self.data[variable], minlength=len(self._groupcounts))
+        return sums / self._groupcounts
+
+    def GroupStd(self,variable):
+        """
+        Standard deviation of variable in each group of GroupBy, in the
+        order of keysgrouped.
+        """
+        mean = self.GroupMean(variable)
+        residuals = _np.asarray(self.data[variable]) - mean[self._groupinverse]
+        sumsq = _np.bincount(self._groupinverse, weights=residuals**2, minlength=len(self._groupcounts))
+        return _np.sqrt(sumsq / self._groupcounts)
 
     def GenerateSigmas(self):
         if hasattr(self,'datagrouped') == False:
             self.GroupBy()
         
         z = self.keysgrouped
-        sx,sy = [],[]
-
-        for i in range(len(self.keysgrouped)):
-            sx.append(_np.std(self.datagrouped[self.keysgrouped[i]]['X']))
-            sy.append(_np.std(self.datagrouped[self.keysgrouped[i]]['Y']))
+        sx = list(self.GroupStd('X'))
+        sy = list(self.GroupStd('Y'))
         self.simpledata = {'sx':sx,'sy':sy,'z':z}
 
     def SortBy(self,variable='Z'):
@@ -57,8 +57,8 @@ def IsFloat(stringtotest):
 
 def CheckItsBDSAsciiData(bfile):
     if type(bfile) == str:
-        data = pybdsim.Data.Load(bfile)
-    elif type(bfile) == pybdsim.Data.BDSAsciiData:
+        data = Data.LoadMemoized(bfile)
+    elif type(bfile) == Data.BDSAsciiData:
         data = bfile
     else:
         raise IOError("Not pybdsim.Data.BDSAsciiData file type: "+str(bfile))
@@ -78,14 +78,14 @@ def IsSurvey(file):
     """
     Checks if input is a BDSIM generated survey
     """
-    if isinstance(file,_np.str):
-        machine = pybdsim.Data.Load(file)
-    elif isinstance(file,pybdsim.Data.BDSAsciiData):
-        machine = file
+    if isinstance(file,str):
+        names = Data.Inspect(file)['names'] # only reads the header
+    elif isinstance(file,Data.BDSAsciiData):
+        names = file.names
     else:
         raise IOError("Unknown input type - not BDSIM data")
 
-    return machine.names.count('SStart') != 0
+    return names is not None and names.count('SStart') != 0
 
 def IsROOTFile(path):
     """Check if input is a ROOT file."""
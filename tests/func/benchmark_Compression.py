@@ -0,0 +1,93 @@
+"""
+Benchmark of loading gzip, bzip2 and xz compressed ascii output against
+the plain file, and of the background decompression (Data._Prefetch)
+against reading the blocks in turn. On a machine with more than one core
+the prefetched load should take close to the larger of the decode and
+parse times rather than their sum.
+
+python benchmark_Compression.py [nrows]
+"""
+import bz2
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from pybdsim import Data
+
+try:
+    import lzma
+except ImportError:
+    lzma = None # python 2
+
+
+def _Sequential(f, blocksize, depth=2):
+    """
+    Data._Prefetch without the background thread.
+    """
+    while True:
+        block = f.read(blocksize)
+        if not block:
+            return
+        yield block
+
+
+def _Time(function, repeats=3):
+    times = []
+    for i in range(repeats):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def Benchmark(nrows=400000):
+    directory = tempfile.mkdtemp()
+    try:
+        source = os.path.join(directory, 'output.eloss.txt')
+        values = np.random.RandomState(1).standard_normal((nrows, 8))
+        f = open(source, 'w')
+        f.write('# eloss\nX[m] Y[m] Z[m] S[m] E[GeV] W[NA] T[ns] P[NA]\n')
+        np.savetxt(f, values, fmt='%.6e')
+        f.close()
+
+        openers = [('gz', gzip.open), ('bz2', bz2.BZ2File)]
+        if lzma is not None:
+            openers.append(('xz', lzma.open))
+        paths = [('plain', source)]
+        for extension,opener in openers:
+            path = source + '.' + extension
+            f = opener(path, 'wb')
+            f.write(open(source, 'rb').read())
+            f.close()
+            paths.append((extension, path))
+
+        plain = Data.Load(source, cache=False)
+        print('%d rows, best of 3 (s)' % nrows)
+        print('%-6s %8s %10s %11s' % ('', 'decode', 'prefetch', 'sequential'))
+        for name,path in paths:
+            def Decode():
+                f = Data._Open(path)
+                while f.read(Data._BLOCKSIZE):
+                    pass
+                f.close()
+            loaded   = Data.Load(path, cache=False)
+            assert np.array_equal(loaded.E(), plain.E())
+            decode   = _Time(Decode)
+            prefetch = _Time(lambda: Data.Load(path, cache=False))
+            Data._Prefetch, prefetcher = _Sequential, Data._Prefetch
+            try:
+                sequential = _Time(lambda: Data.Load(path, cache=False))
+            finally:
+                Data._Prefetch = prefetcher
+            print('%-6s %8.3f %10.3f %11.3f' % (name, decode, prefetch, sequential))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    Benchmark(*[int(a) for a in sys.argv[1:]])
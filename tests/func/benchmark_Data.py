@@ -0,0 +1,60 @@
+"""
+Benchmark of the BDSAsciiData column getters against the list of tuples
+storage they replaced, where every getter call built a new array from
+the rows.
+
+python benchmark_Data.py [nrows] [repeats]
+"""
+import sys
+import timeit
+
+import numpy as np
+
+from pybdsim import Data
+
+
+class ListOfTuples(list):
+    """
+    The previous storage - a list of row tuples with getters that build
+    a new array with a list comprehension over every row.
+    """
+    def __init__(self, names, rows):
+        list.__init__(self, rows)
+        self.names = names
+
+    def GetColumn(self, name):
+        ind = self.names.index(name)
+        return np.array([event[ind] for event in self])
+
+
+def Benchmark(nrows=100000, repeats=20):
+    names = ['S', 'Beta_x', 'Beta_y']
+    s     = np.linspace(0, 1000, nrows)
+    rows  = list(zip(s.tolist(), np.sin(s).tolist(), np.cos(s).tolist()))
+
+    old = ListOfTuples(names, rows)
+    new = Data.BDSAsciiData()
+    for name in names:
+        new._AddProperty(name, 'm')
+    new.extend(rows)
+    new._Consolidate()
+
+    def Old():
+        return [old.GetColumn(name) for name in names]
+
+    def New():
+        return [new.S(), new.Beta_x(), new.Beta_y()]
+
+    for a,b in zip(Old(), New()):
+        assert np.array_equal(a, b)
+
+    told = min(timeit.repeat(Old, number=1, repeat=repeats))
+    tnew = min(timeit.repeat(New, number=1, repeat=repeats))
+    print('S(), Beta_x(), Beta_y() of ' + str(nrows) + ' rows')
+    print('list of tuples: %.3g s' % told)
+    print('columnar      : %.3g s' % tnew)
+    print('speedup       : %.0fx' % (told / tnew))
+
+
+if __name__ == '__main__':
+    Benchmark(*[int(a) for a in sys.argv[1:]])
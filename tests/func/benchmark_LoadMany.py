@@ -0,0 +1,69 @@
+"""
+Benchmark of Data.LoadMany against a sequential loop of Data.Load over
+the same files, as for merging the per job output of a batch of runs.
+
+python benchmark_LoadMany.py [nfiles] [nrows] [workers]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from pybdsim import Data
+
+
+def WriteFiles(directory, nfiles, nrows):
+    values = np.random.RandomState(1).standard_normal((nrows, 8))
+    for i in range(nfiles):
+        f = open(os.path.join(directory, 'job%03d.eloss.txt' % i), 'w')
+        f.write('# eloss\nX[m] Y[m] Z[m] S[m] E[GeV] W[NA] T[ns] P[NA]\n')
+        np.savetxt(f, values + i, fmt='%.6e')
+        f.close()
+
+
+def Sequential(paths):
+    """
+    Load each file in turn with Data.Load and merge the columns.
+    """
+    loaded = [Data.Load(path, cache=False) for path in paths]
+    names  = loaded[0].names
+    units  = loaded[0].units
+    columns = [np.concatenate([getattr(d, name)() for d in loaded]) for name in names]
+    return Data._BuildFromColumns(names, units, columns)
+
+
+def Benchmark(nfiles=40, nrows=50000, workers=4):
+    directory = tempfile.mkdtemp()
+    try:
+        WriteFiles(directory, nfiles, nrows)
+        pattern = os.path.join(directory, 'job*.eloss.txt')
+        paths   = sorted(os.path.join(directory, n) for n in os.listdir(directory))
+
+        start = time.time()
+        old   = Sequential(paths)
+        told  = time.time() - start
+
+        start = time.time()
+        one   = Data.LoadMany(pattern)
+        tone  = time.time() - start
+
+        start = time.time()
+        new   = Data.LoadMany(pattern, workers=workers)
+        tnew  = time.time() - start
+
+        for name in old.names:
+            assert np.array_equal(getattr(old, name)(), getattr(new, name)())
+            assert np.array_equal(getattr(old, name)(), getattr(one, name)())
+        print('%d files of %d rows' % (nfiles, nrows))
+        print('Data.Load loop       : %.3g s' % told)
+        print('LoadMany, 1 worker   : %.3g s' % tone)
+        print('LoadMany, %d workers  : %.3g s (%.1fx)' % (workers, tnew, told / tnew))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    Benchmark(*[int(a) for a in sys.argv[1:]])
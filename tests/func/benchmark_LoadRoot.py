@@ -0,0 +1,70 @@
+"""
+Benchmark of building BDSAsciiData from the structured array root_numpy
+gives for an optics tree against the per element loop _LoadRoot used
+before. A generated stand-in array is used so ROOT isn't needed.
+
+python benchmark_LoadRoot.py [nrows] [nbranches]
+"""
+import sys
+import time
+
+import numpy as np
+
+from pybdsim import Data
+
+
+def StandInTree(nrows, nbranches):
+    """
+    Structured array like root2array returns for an optics tree.
+    """
+    names = ['S'] + ['Branch%d' % i for i in range(nbranches - 1)]
+    array = np.zeros(nrows, dtype=[(n, 'f8') for n in names])
+    rng   = np.random.RandomState(1)
+    for n in names:
+        array[n] = rng.standard_normal(nrows)
+    return array
+
+
+def PerElement(treedata, branches):
+    """
+    The row by row loop _LoadRoot used before.
+    """
+    data = Data.BDSAsciiData()
+    for element in range(len(treedata[branches[0]])):
+        elementlist = []
+        for branch in branches:
+            if element == 0:
+                data._AddProperty(branch)
+            elementlist.append(treedata[branch][element])
+        data.append(elementlist)
+    data._Consolidate()
+    return data
+
+
+def Benchmark(nrows=100000, nbranches=30):
+    tree     = StandInTree(nrows, nbranches)
+    branches = list(tree.dtype.names)
+
+    start = time.time()
+    old   = PerElement(tree, branches)
+    told  = time.time() - start
+
+    start = time.time()
+    new   = Data._BuildFromStructuredArray(tree, branches)
+    tnew  = time.time() - start
+
+    subset = branches[:3]
+    start  = time.time()
+    Data._BuildFromStructuredArray(tree, subset)
+    tsub   = time.time() - start
+
+    for name in branches:
+        assert np.array_equal(getattr(old, name)(), getattr(new, name)())
+    print(str(nrows) + ' elements, ' + str(nbranches) + ' branches')
+    print('per element loop : %.3g s' % told)
+    print('columns          : %.3g s (%.0fx)' % (tnew, told / tnew))
+    print('3 columns        : %.3g s' % tsub)
+
+
+if __name__ == '__main__':
+    Benchmark(*[int(a) for a in sys.argv[1:]])
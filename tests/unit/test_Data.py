@@ -0,0 +1,513 @@
+import io
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from pybdsim import Data
+
+
+def _WriteOptics(path, nrows, offset=0.0):
+    f = open(path, 'w')
+    f.write('# optics\n')
+    f.write('Name S[m] Beta_x[m] Beta_y[m]\n')
+    for i in range(nrows):
+        f.write('el%d %.6f %.6f %.6f\n' % (i, 0.1*i, offset + i, offset - i))
+    f.close()
+
+
+def test_columnar_overwritten_file_keeps_data(tmpdir):
+    source = str(tmpdir.join('y.txt'))
+    other  = str(tmpdir.join('o.txt'))
+    path   = str(tmpdir.join('y.bdscol'))
+    _WriteOptics(source, 10)
+    _WriteOptics(other, 20, offset=100.0)
+
+    Data.Load(source, cache=False).Save(path)
+    y = Data.Load(path)
+    y.S()
+    Data.Load(other, cache=False).Save(path)
+
+    # columns not used before the file was overwritten are still this file's
+    assert len(y.Beta_x()) == 10
+    assert np.all(y.Beta_x() == np.arange(10.0))
+    assert np.all(y.Beta_y() == -np.arange(10.0))
+
+
+def test_columnar_removed_file_keeps_data(tmpdir):
+    source = str(tmpdir.join('y.txt'))
+    path   = str(tmpdir.join('y.bdscol'))
+    _WriteOptics(source, 10)
+    Data.Load(source, cache=False).Save(path)
+    y = Data.Load(path)
+    os.remove(path)
+    assert np.all(y.Beta_x() == np.arange(10.0))
+
+
+def test_cache_rewritten_sidecar_keeps_data(tmpdir):
+    source = str(tmpdir.join('optics.txt'))
+    _WriteOptics(source, 10)
+    Data.EnableCache(str(tmpdir.join('cache')))
+    try:
+        Data.Load(source)
+        y = Data.Load(source) # opened from the sidecar
+        y.S()
+        _WriteOptics(source, 30, offset=100.0)
+        os.utime(source, (0, 0))
+        Data.Load(source) # rewrites the sidecar
+        assert np.all(y.Beta_x() == np.arange(10.0))
+        Data.ClearCache()
+        assert np.all(y.Beta_y() == -np.arange(10.0))
+    finally:
+        Data.ClearCache()
+        Data.DisableCache()
+
+
+def test_getters_views_and_getcolumn_copies(tmpdir):
+    source = str(tmpdir.join('optics.txt'))
+    _WriteOptics(source, 5)
+    d = Data.Load(source, cache=False)
+
+    s = d.GetColumn('S')
+    s -= s[0] + 1.0
+    assert d.S()[0] == 0.0
+
+    s = d.S().copy()
+    s -= 1.0
+    assert d.S()[0] == 0.0
+    assert not d.S().flags.writeable
+
+
+def test_rows_like_a_list(tmpdir):
+    source = str(tmpdir.join('optics.txt'))
+    _WriteOptics(source, 5)
+    d = Data.Load(source, cache=False)
+    rows = list(d)
+
+    assert d.GetItemTuple(slice(1, 3)) == rows[1:3]
+    assert d[1:3] == [dict(zip(d.names, r)) for r in rows[1:3]]
+    assert d[::-2] == [dict(zip(d.names, r)) for r in rows[::-2]]
+    assert d.index(rows[2]) == 2
+    assert d.count(rows[2]) == 1
+
+    assert d.pop() == rows[-1]
+    assert d.pop(0) == rows[0]
+    assert list(d) == rows[1:-1]
+    d.insert(0, ('longelementname', -1.0, 2.0, 3.0))
+    assert d.GetItemTuple(0) == ('longelementname', -1.0, 2.0, 3.0)
+    assert len(d) == 4
+
+    d.sort(key=lambda r: r[2])
+    assert list(d.Beta_x()) == sorted(d.Beta_x())
+    d.reverse()
+    assert list(d.Beta_x()) == sorted(d.Beta_x(), reverse=True)
+    d.remove(('longelementname', -1.0, 2.0, 3.0))
+    assert len(d) == 3 and 'longelementname' not in d.Name()
+
+
+def test_rows_of_wrong_length():
+    d = Data.BDSAsciiData()
+    for name in ['S', 'Beta_x']:
+        d._AddProperty(name)
+    d.append((0.0, 1.0))
+    with pytest.raises(ValueError, match=r'Row 1 \(1.0, 2.0, 3.0\) has 3 values but the data has 2 columns'):
+        d.append((1.0, 2.0, 3.0))
+    with pytest.raises(ValueError, match='Row 1'):
+        d.append((1.0,))
+    with pytest.raises(ValueError, match='Row 0'):
+        d.insert(0, (1.0,))
+    assert list(d) == [(0.0, 1.0)]
+
+    # rows appended before the columns are named are checked all at once
+    d = Data.BDSAsciiData([(0.0, 1.0), (1.0,), (2.0, 3.0)])
+    for name in ['S', 'Beta_x']:
+        d._AddProperty(name)
+    with pytest.raises(ValueError, match=r'Row 1 \(1.0,\)'):
+        d.S()
+    assert d._nrows == 0 and len(d._data) == 0
+
+
+def _AssertSameData(a, b):
+    assert a.names == b.names
+    assert len(a) == len(b)
+    for name in a.names:
+        x = getattr(a, name)()
+        y = getattr(b, name)()
+        assert x.dtype == y.dtype
+        if x.dtype.kind == 'f':
+            assert np.array_equal(np.isnan(x), np.isnan(y))
+            assert np.all((x == y) | np.isnan(x))
+        else:
+            assert np.all(x == y)
+
+
+def test_bulk_parser_matches_line_loader(tmpdir):
+    tables = {'numeric.txt' : ['1.5 -2e-3 7', 'nan inf -inf', '1E+300 .5 5.', '-0 +2 3'],
+              'strings.txt' : ['1 a 2', '3 b 4', '5 c 6'],
+              'late.txt'    : ['%d %d %d' % (i, i, i) for i in range(150)] + ['1 x 0x10', '2 1d5 3'],
+              'names.txt'   : ['d1 1 2', 'nanny 3 4', 'infield 5 6', '-x 7 8', 'a'*300 + ' 9 10'],
+              'numbered.txt': ['d1 1 2', 'q2 3 4'] * 60 + ['17 5 6'],
+              'unicode.txt' : ['d1 1 2', u'd\u00e9 3 4']}
+    for filename,rows in tables.items():
+        path = str(tmpdir.join(filename))
+        f = io.open(path, 'w', encoding='utf-8')
+        f.write(u'# header\nA[m] B[m] C[m]\n# comment\n' + u'\n'.join(rows) + u'\n')
+        f.close()
+        _AssertSameData(Data._LoadAsciiLines(path), Data.Load(path, cache=False))
+
+
+def test_bulk_parser_blocks(tmpdir):
+    path = str(tmpdir.join('blocks.txt'))
+    _WriteOptics(path, 1000)
+    f = open(path)
+    f.readline()
+    names, units = Data._ParseHeaderLine(f.readline())
+    columns = Data._ParseColumns(Data._ReadBlocks(f, blocksize=1000), len(names))
+    f.close()
+    _AssertSameData(Data._LoadAsciiLines(path), Data._BuildFromColumns(names, units, columns))
+
+
+def test_iterate_histogram(tmpdir):
+    path = str(tmpdir.join('output.elosshist.txt'))
+    f = open(path, 'w')
+    f.write('# histogram\nBinLow[m] BinHigh[m] Value\nUnderflow 3.5\nOverflow 2.0\n')
+    for i in range(25):
+        f.write('%d %d %d\n' % (i, i+1, i*i))
+    f.close()
+
+    loaded = Data.Load(path, cache=False)
+    chunks = list(Data.Iterate(path, chunksize=10))
+    assert [len(c) for c in chunks] == [8, 10, 7]
+    for chunk in chunks:
+        assert chunk.underflow == 3.5 and chunk.overflow == 2.0
+    assert np.all(np.concatenate([c.BinLow() for c in chunks]) == loaded.BinLow())
+    assert np.all(np.concatenate([c.Value() for c in chunks]) == loaded.Value())
+    assert loaded.BinLow().dtype.kind == 'f'
+
+
+def test_filtered_columnar_view(tmpdir):
+    path = str(tmpdir.join('output.elosshist.txt'))
+    f = open(path, 'w')
+    f.write('# histogram\nBinLow[m] BinHigh[m] Value\nUnderflow 3.5\nOverflow 2.0\n')
+    for i in range(10):
+        f.write('%d %d %d\n' % (i, i+1, i*i))
+    f.close()
+    Data.Load(path, cache=False).Save(str(tmpdir.join('h.bdscol')))
+
+    h = Data.Load(str(tmpdir.join('h.bdscol')))
+    v = h.Filter(h.Value() > 10)
+    w = v.Filter(v.BinLow() < 8)
+    for view,nrows in [(v, 6), (w, 4)]:
+        assert len(view) == nrows
+        assert view.underflow == 3.5 and view.overflow == 2.0
+        # no column of the file used through the view yet
+        assert len(view._data) == 3 and sorted(view._data) == ['BinHigh', 'BinLow', 'Value']
+        with pytest.raises(ValueError, match='has 5 entries but the data has %d' % nrows):
+            view._SetColumn('Extra', np.zeros(5))
+        view._SetColumn('Extra', np.zeros(nrows))
+        assert len(view._data) == 4 and 'Extra' in list(view._data)
+    assert list(w.Value()) == [16.0, 25.0, 36.0, 49.0]
+
+
+def _Survey(sstart, arclen):
+    data = Data.BDSAsciiData()
+    for name,unit in [('Name', 'NA'), ('SStart', 'm'), ('Arc_len', 'm')]:
+        data._AddProperty(name, unit)
+    data.extend([('e%d' % i, s, l) for i,(s,l) in enumerate(zip(sstart, arclen))])
+    return data
+
+
+def test_indices_from_s_containment():
+    # e0 [0,1), gap [1,2), e1 [2,3), marker at 3, e2 [3,4)
+    survey = _Survey([0.0, 2.0, 3.0, 3.0], [1.0, 1.0, 0.0, 1.0])
+    s = [-0.5, 0.0, 0.5, 1.0, 1.5, 2.0, 3.0, 3.5, 4.0, 5.0]
+    assert list(survey.IndicesFromS(s, outside='flag')) == [-1, 0, 0, -1, -1, 1, 3, 3, -1, -1]
+    assert list(survey.IndicesFromS(s, outside='clip')) == [0, 0, 0, 0, 0, 1, 3, 3, 3, 3]
+    for value in [1.0, 4.0, -0.5]:
+        with pytest.raises(ValueError):
+            survey.IndicesFromS(value, outside='raise')
+
+    # marker after the element at the same S, and the data out of order
+    survey = _Survey([3.0, 0.0, 3.0, 2.0], [1.0, 1.0, 0.0, 1.0])
+    assert list(survey.IndicesFromS([0.5, 1.5, 2.5, 3.0, 3.5], outside='flag')) == [1, -1, 3, 0, 0]
+
+
+def test_join_on_s_drops_gaps():
+    survey = _Survey([0.0, 2.0], [1.0, 1.0])
+    losses = Data.BDSAsciiData()
+    losses._AddProperty('S', 'm')
+    losses.extend([(0.5,), (1.5,), (2.5,), (3.0,)])
+    joined = Data.Join(losses, survey, on='S', how='inner')
+    assert list(joined.S()) == [0.5, 2.5]
+    assert list(joined.Name()) == ['e0', 'e1']
+    joined = Data.Join(losses, survey, on='S', how='left')
+    assert list(joined.Name()) == ['e0', '', 'e1', '']
+
+
+def test_eval_cache_is_bounded():
+    data = Data.BDSAsciiData()
+    data._AddProperty('E', 'GeV')
+    data.extend([(float(i),) for i in range(100)])
+    for i in range(50):
+        assert len(data.Where('E > %f' % (i + 0.5))) == 99 - i
+    assert len(data._derived.get('eval', {})) == 0
+
+    for i in range(50):
+        assert np.all(data.Eval('E * %d' % i) == data.E() * i)
+    assert len(data._derived['eval']) == Data._EVALCACHESIZE
+    assert data.Eval('E * 49') is not data.Eval('E * 49') # views of one result
+    assert data.Eval('E * 49').base is data.Eval('E * 49').base
+
+
+def test_join_blocks_keeps_numeric_dtypes():
+    ints = [np.arange(5, dtype=np.int32), np.arange(3, dtype=np.int32)]
+    assert Data._JoinBlocks(ints).dtype == np.int32
+    assert list(Data._JoinBlocks(ints)) == [0, 1, 2, 3, 4, 0, 1, 2]
+    mixed = Data._JoinBlocks([np.array([True, False]), np.arange(2), np.array([0.5])])
+    assert mixed.dtype.kind == 'f' and list(mixed) == [1, 0, 0, 1, 0.5]
+    assert Data._JoinBlocks([np.array(['a']), np.array(['bcd'])]).dtype == np.dtype('<U3')
+    assert list(Data._JoinBlocks([np.array(['a']), np.array([1.5])])) == ['a', '1.5']
+
+
+def test_cache_next_to_source_bounded_and_cleared(tmpdir, monkeypatch):
+    monkeypatch.setattr(Data, '_SIDECARINDEX', str(tmpdir.join('index', 'sidecars.txt')))
+    sources = [str(tmpdir.join('optics%d.txt' % i)) for i in range(3)]
+    for source in sources:
+        _WriteOptics(source, 10)
+    Data.EnableCache()
+    try:
+        Data.Load(sources[0])
+        size = os.path.getsize(sources[0] + '.bdscol')
+        Data.EnableCache(maxsize=2*size)
+        for i,source in enumerate(sources):
+            Data.Load(source)
+            os.utime(source + '.bdscol', (i, i)) # used in order
+        Data._EvictCache()
+        assert [os.path.isfile(s + '.bdscol') for s in sources] == [False, True, True]
+        assert np.all(Data.Load(sources[2]).Beta_x() == np.arange(10.0))
+
+        Data.ClearCache()
+        assert not any([os.path.isfile(s + '.bdscol') for s in sources])
+        assert Data._CacheFiles() == []
+    finally:
+        Data.ClearCache()
+        Data.DisableCache()
+
+
+def _Compress(source, path, compression):
+    import bz2, gzip
+    data = open(source, 'rb').read()
+    if compression == 'gzip':
+        f = gzip.open(path, 'wb')
+    elif compression == 'bzip2':
+        f = bz2.BZ2File(path, 'wb')
+    else:
+        lzma = pytest.importorskip('lzma')
+        f = lzma.open(path, 'wb')
+    f.write(data)
+    f.close()
+
+
+@pytest.mark.parametrize('compression,extension', [('gzip', 'gz'), ('bzip2', 'bz2'), ('xz', 'xz')])
+def test_load_compressed(tmpdir, compression, extension):
+    source = str(tmpdir.join('optics.txt'))
+    _WriteOptics(source, 300)
+    plain = Data.Load(source, cache=False)
+
+    # by extension and by magic bytes alone
+    for path in [source + '.' + extension, str(tmpdir.join('compressed_optics.txt'))]:
+        _Compress(source, path, compression)
+        assert Data._Compression(path) == compression
+        _AssertSameData(plain, Data.Load(path, cache=False))
+        chunks = list(Data.Iterate(path, chunksize=100))
+        assert np.all(np.concatenate([c.Beta_x() for c in chunks]) == plain.Beta_x())
+    assert Data._Compression(source) is None
+
+
+def test_prefetch_blocks(tmpdir):
+    import threading
+    source = str(tmpdir.join('optics.txt'))
+    _WriteOptics(source, 300)
+    text = open(source).read()
+    nthreads = threading.active_count()
+
+    f = open(source)
+    assert ''.join(Data._Prefetch(f, 100)) == text
+    f.close()
+    assert threading.active_count() == nthreads
+
+    # stopping early leaves no reader thread behind
+    f = open(source)
+    blocks = Data._Prefetch(f, 100, depth=1)
+    assert next(blocks) == text[:100]
+    blocks.close()
+    f.close()
+    assert threading.active_count() == nthreads
+
+    # lines are whole however the blocks fall
+    f = open(source)
+    assert ''.join(Data._ReadBlocks(f, blocksize=7)) == text.replace('# optics\n', '')
+    f.close()
+
+
+def test_prefetch_read_error():
+    class Failing(object):
+        def read(self, size):
+            raise IOError('read failed')
+    with pytest.raises(IOError):
+        list(Data._Prefetch(Failing(), 100))
+
+
+def _OpticsTree(nrows=50):
+    dtype = [('S', 'f8'), ('Beta_x', 'f8'), ('Beta_y', 'f4'), ('Npart', 'i4'), ('Flag', '?')]
+    array = np.zeros(nrows, dtype=dtype)
+    array['S']      = np.linspace(0, 10, nrows)
+    array['Beta_x'] = np.sin(array['S'])
+    array['Beta_y'] = np.cos(array['S'])
+    array['Npart']  = np.arange(nrows)
+    array['Flag']   = np.arange(nrows) % 2 == 0
+    return array
+
+
+def _BuildPerElement(treedata, branches):
+    # the row by row loop _LoadRoot used before
+    data = Data.BDSAsciiData()
+    for element in range(len(treedata[branches[0]])):
+        elementlist = []
+        for branch in branches:
+            if element == 0:
+                data._AddProperty(branch)
+            elementlist.append(treedata[branch][element])
+        data.append(elementlist)
+    return data
+
+
+def test_build_from_structured_array():
+    tree = _OpticsTree()
+    for branches in [list(tree.dtype.names), ['Beta_y', 'S']]:
+        old = _BuildPerElement(tree, branches)
+        new = Data._BuildFromStructuredArray(tree, branches)
+        _AssertSameData(old, new)
+        assert new.units == old.units
+        assert list(new) == list(old)
+
+
+def test_load_many_glob_and_source_column(tmpdir):
+    for i in range(3):
+        _WriteOptics(str(tmpdir.join('run%d.txt' % i)), 5 + i, offset=10.0*i)
+    pattern = str(tmpdir.join('run*.txt'))
+    paths   = sorted(str(p) for p in tmpdir.listdir('run*.txt'))
+
+    merged = Data.LoadMany(pattern, sourcecolumn='Source')
+    assert merged.sources == paths
+    assert len(merged) == 5 + 6 + 7
+    assert np.array_equal(merged.Source(), [0]*5 + [1]*6 + [2]*7)
+    expected = np.concatenate([Data.Load(p, cache=False).Beta_x() for p in paths])
+    assert np.array_equal(merged.Beta_x(), expected)
+    assert list(merged.Name()[:2]) == ['el0', 'el1']
+
+    # the same from a list of paths, without the extra column
+    fromlist = Data.LoadMany(paths)
+    assert 'Source' not in fromlist.columns
+    assert np.array_equal(fromlist.Beta_y(), merged.Beta_y())
+
+
+def test_load_many_header_mismatch(tmpdir):
+    good = str(tmpdir.join('good.txt'))
+    bad  = str(tmpdir.join('bad.txt'))
+    _WriteOptics(good, 4)
+    f = open(bad, 'w')
+    f.write('# optics\nName S[m] Beta_x[m] Alpha_y[NA]\nel0 0.0 1.0 2.0\n')
+    f.close()
+    with pytest.raises(ValueError, match='bad.txt'):
+        Data.LoadMany([good, bad])
+    with pytest.raises(IOError):
+        Data.LoadMany(str(tmpdir.join('none*.txt')))
+
+
+def _StreamValues(n=20000, seed=1):
+    # columns over many magnitudes, signed with zeros, and correlated
+    rng = np.random.RandomState(seed)
+    a = rng.lognormal(0, 3, n)
+    b = rng.standard_normal(n) * 1e-3 + 2e-3
+    b[::50] = 0
+    c = 0.5*a + rng.standard_normal(n)
+    return np.column_stack([a, b, c])
+
+
+def test_stream_statistics_match_numpy():
+    values = _StreamValues()
+    stats  = Data.StreamStatistics(['A', 'B', 'C'])
+    for chunk in np.array_split(values, 7):
+        stats.Add(chunk)
+    assert stats.n == len(values)
+    assert np.allclose(stats.Mean(), values.mean(axis=0))
+    assert np.allclose(stats.Covariance(), np.cov(values.T, ddof=0))
+    assert np.allclose(stats.Covariance(ddof=1), np.cov(values.T))
+    assert np.allclose(stats.Std(), values.std(axis=0))
+    assert np.allclose(stats.RMS(), np.sqrt((values**2).mean(axis=0)))
+    assert np.array_equal(stats.min, values.min(axis=0))
+    assert np.array_equal(stats.max, values.max(axis=0))
+
+    # the same from a BDSAsciiData instance, with the columns picked by name
+    data = Data._BuildFromColumns(['C', 'A', 'B'], ['NA']*3, [values[:,2], values[:,0], values[:,1]])
+    named = Data.StreamStatistics(['A', 'B', 'C'])
+    named.Add(data)
+    assert np.allclose(named.Covariance(), stats.Covariance())
+
+
+@pytest.mark.parametrize('relativeaccuracy', [0.01, 0.001])
+def test_stream_statistics_quantiles(relativeaccuracy):
+    values = _StreamValues(seed=2)
+    stats  = Data.StreamStatistics(['A', 'B', 'C'], relativeaccuracy)
+    stats.Add(values)
+    qs     = np.array([0, 0.001, 0.1, 0.25, 0.5, 0.75, 0.9, 0.999, 1])
+    result = stats.Quantile(qs)
+    assert result.shape == (len(qs), 3)
+    ordered = np.sort(values, axis=0)[np.floor(qs*(len(values) - 1)).astype(int)]
+    assert np.all(np.abs(result - ordered) <= relativeaccuracy*np.abs(ordered))
+    assert np.allclose(stats.Percentile(50), result[4])
+
+
+def test_stream_statistics_merge_is_one_pass():
+    values = _StreamValues(seed=3)
+    single = Data.StreamStatistics(['A', 'B', 'C'])
+    single.Add(values)
+    merged = Data.StreamStatistics(['A', 'B', 'C'])
+    for chunk in np.array_split(values, 5):
+        part = Data.StreamStatistics(['A', 'B', 'C'])
+        part.Add(chunk)
+        merged.Merge(part)
+    merged.Merge(Data.StreamStatistics(['A', 'B', 'C'])) # empty
+
+    assert merged.n == single.n
+    assert np.allclose(merged.Mean(), single.Mean())
+    assert np.allclose(merged.Covariance(), single.Covariance())
+    assert np.array_equal(merged.min, single.min) and np.array_equal(merged.max, single.max)
+    # the sketches add exactly
+    assert np.array_equal(merged.Quantile(np.linspace(0, 1, 101)), single.Quantile(np.linspace(0, 1, 101)))
+
+    with pytest.raises(ValueError):
+        merged.Merge(Data.StreamStatistics(['A', 'B']))
+    with pytest.raises(ValueError):
+        merged.Merge(Data.StreamStatistics(['A', 'B', 'C'], 0.05))
+
+
+def test_pickle_and_load_in_workers(tmpdir):
+    paths = [str(tmpdir.join('optics%d.txt' % i)) for i in range(3)]
+    for i,path in enumerate(paths):
+        _WriteOptics(path, 5 + i, offset=10.0*i)
+    Data.Load(paths[0], cache=False).Save(str(tmpdir.join('optics.bdscol')))
+
+    for d in [Data.Load(paths[1], cache=False), Data.Load(str(tmpdir.join('optics.bdscol')))]:
+        copy = pickle.loads(pickle.dumps(d))
+        _AssertSameData(copy, d)
+        assert np.array_equal(copy.Beta_x(), d.Beta_x())
+
+    serial   = Data.Load(paths[0], cache=False)
+    parallel = Data.Load(paths[0], cache=False)
+    serial.ConcatenateMachine(*paths[1:])
+    parallel.ConcatenateMachine(*paths[1:], workers=2)
+    _AssertSameData(parallel, serial)
+    assert len(parallel) == 5 + 6 + 7
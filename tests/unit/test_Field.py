@@ -0,0 +1,323 @@
+import tarfile
+
+import numpy as np
+import pytest
+
+from pybdsim import Field
+from pybdsim.Field import _Field
+from pybdsim.Field import _Loader
+
+# values whose formatting is easy to get wrong
+SPECIAL = [0.0, -0.0, np.nan, np.inf, -np.inf,
+           5e-324, -5e-324, 2.2250738585072014e-308, 1e-310, -1.5e-320, # subnormals
+           1e-100, 9.999999999e-100, 1e100, -1.234e-150, 1e200, 1.7976931348623157e308, # 3 digit exponents
+           100000000.5, 100000001.5, -123456788.5, 987654321.5, 0.125, 2.5, -1.5, # exact ties
+           1.0000000050000001, 9.9999999949999999, 9.999999995, 0.99999999950000002, # near ties
+           1.0, -1.0, 10.0, 0.1, 1e-5, 123456789.0, 1e99, 9.9999999999e99, 1e-99]
+
+
+def _Reference(field):
+    """
+    The text the value by value writer produced - the header, the column
+    line and each value as '%.8E' right aligned in 14 characters
+    ('%.16E' in 23 for double precision).
+    """
+    if field.doublePrecision:
+        valueFormat, width = '%.16E', '%23s'
+    else:
+        valueFormat, width = '%.8E', '%14s'
+    lines = [str(key)+'> '+ str(value) + '\n' for key,value in field.header.items()]
+    colStrings = [width % s for s in field.columns]
+    colStrings[0] = colStrings[0].strip()
+    lines.append('! '+ '\t'.join(colStrings)+'\n')
+    data = field.data
+    if field.flip:
+        inds = list(range(data.ndim))
+        inds[:(data.ndim - 1)] = reversed(inds[:(data.ndim - 1)])
+        data = np.transpose(data, inds)
+    for row in data.reshape(-1, data.shape[-1]):
+        lines.append('\t'.join([width % (valueFormat % x) for x in row]) + '\n')
+    return ''.join(lines)
+
+
+def _Values(n, seed=1):
+    """
+    n values - the special ones then random ones over many magnitudes.
+    """
+    rng    = np.random.RandomState(seed)
+    random = rng.uniform(-1, 1, n) * 10.0**rng.randint(-30, 30, n)
+    values = np.concatenate([SPECIAL, random])[:n]
+    return rng.permutation(values)
+
+
+def _Fields(doublePrecision):
+    return [Field.Field1D(_Values(40*4).reshape(40,4), doublePrecision),
+            Field.Field2D(_Values(6*7*5, 2).reshape(6,7,5), doublePrecision=doublePrecision),
+            Field.Field3D(_Values(3*4*5*6, 3).reshape(3,4,5,6), doublePrecision=doublePrecision),
+            Field.Field4D(_Values(2*3*4*5*7, 4).reshape(2,3,4,5,7), doublePrecision=doublePrecision),
+            Field.Field3D(_Values(3*4*5*6, 5).reshape(3,4,5,6), flip=False, doublePrecision=doublePrecision)]
+
+
+@pytest.mark.parametrize('doublePrecision', [False, True])
+def test_write_matches_value_by_value_formatting(tmpdir, doublePrecision):
+    for i,field in enumerate(_Fields(doublePrecision)):
+        path = str(tmpdir.join('field%d.dat' % i))
+        field.Write(path)
+        assert open(path).read() == _Reference(field)
+
+
+def test_write_special_values_every_position(tmpdir):
+    # each special value in every column of a row, alone and among others
+    for value in SPECIAL:
+        data = np.full((3, 4), 1.5)
+        data[1] = value
+        field = Field.Field1D(data)
+        path  = str(tmpdir.join('special.dat'))
+        field.Write(path)
+        assert open(path).read() == _Reference(field)
+
+
+def test_write_across_blocks(tmpdir, monkeypatch):
+    monkeypatch.setattr(_Field, '_WRITEBLOCKROWS', 7)
+    field = Field.Field2D(_Values(9*10*5, 6).reshape(9,10,5))
+    path  = str(tmpdir.join('blocks.dat'))
+    field.Write(path)
+    assert open(path).read() == _Reference(field)
+
+
+def test_format_rows_single_random():
+    rng    = np.random.RandomState(7)
+    values = rng.uniform(-1, 1, 200000) * 10.0**rng.randint(-120, 120, 200000)
+    block  = values.reshape(-1, 4)
+    text   = ''.join(['\t'.join(['%14s' % ('%.8E' % x) for x in row]) + '\n' for row in block])
+    assert _Field._FormatRowsSingle(block) == text
+
+
+def _SymmetricMap(nx=5, ny=3, nz=7):
+    # Fx odd in x and y, Fy even, Fz odd in y and z
+    x, y, z = np.linspace(-2, 2, nx), np.linspace(-1, 1, ny), np.linspace(-3, 3, nz)
+    zz, yy, xx = np.meshgrid(z, y, x, indexing='ij')
+    return np.stack([xx, yy, zz, xx*yy, 1 + xx**2 + zz**2, yy*zz], axis=-1)
+
+SYMMETRY = {'x' : (-1, 1, 1), 'y' : (-1, 1, -1), 'z' : (1, 1, -1)}
+
+
+def test_symmetric_slabs_reconstruct_the_map():
+    full = _SymmetricMap()
+    sym  = Field.SymmetricField(full, SYMMETRY)
+    assert sym.data.shape == (4, 2, 3, 6)
+    assert np.allclose(np.array(list(sym._Slabs())), full)
+    assert np.allclose(sym.Full(), full)
+
+    # no grid point on the z=0 plane
+    full = _SymmetricMap(nz=6)
+    assert np.allclose(np.array(list(Field.SymmetricField(full, SYMMETRY)._Slabs())), full)
+
+
+def test_symmetric_slabs_one_at_a_time():
+    tracemalloc = pytest.importorskip('tracemalloc')
+    sym = Field.SymmetricField(_SymmetricMap(21, 21, 201), SYMMETRY)
+    tracemalloc.start()
+    try:
+        slabs = sym._Slabs()
+        slab  = next(slabs)
+        peak  = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 10*slab.nbytes < sym.data.nbytes
+
+
+def test_symmetric_write_full(tmpdir):
+    full = _SymmetricMap()
+    path = str(tmpdir.join('sym.dat'))
+    Field.SymmetricField(full, SYMMETRY).Write(path)
+    assert np.allclose(Field.Load(path), full)
+
+
+def _BinaryDtype(doublePrecision):
+    return np.dtype(np.float64 if doublePrecision else np.float32)
+
+
+@pytest.mark.parametrize('doublePrecision', [False, True])
+def test_write_binary_loads_as_memmap(tmpdir, doublePrecision):
+    for i,field in enumerate(_Fields(doublePrecision)):
+        text   = str(tmpdir.join('field%d.dat' % i))
+        binary = str(tmpdir.join('field%d.bin' % i))
+        field.Write(text)
+        with np.errstate(over='ignore'): # values beyond the float32 range
+            field.Write(binary, binary=True)
+            rows = field._Rows().astype(_BinaryDtype(doublePrecision))
+        loaded = Field.Load(binary)
+        assert isinstance(loaded, np.memmap)
+        assert loaded.dtype == _BinaryDtype(doublePrecision)
+        assert loaded.shape == Field.Load(text).shape
+        assert np.array_equal(loaded.reshape(rows.shape), rows, equal_nan=True)
+
+
+@pytest.mark.parametrize('doublePrecision', [False, True])
+def test_convert_to_binary_and_back(tmpdir, doublePrecision):
+    for i,field in enumerate(_Fields(doublePrecision)):
+        text   = str(tmpdir.join('field%d.dat' % i))
+        binary = str(tmpdir.join('field%d.bin' % i))
+        back   = str(tmpdir.join('field%d.back.dat' % i))
+        field.Write(text)
+        Field.ConvertToBinary(text, binary)
+        assert isinstance(Field.Load(binary), np.memmap)
+        assert np.array_equal(Field.Load(binary), Field.Load(text), equal_nan=True)
+        Field.ConvertToText(binary, back, doublePrecision)
+        assert open(back, 'rb').read() == open(text, 'rb').read()
+
+    with pytest.raises(ValueError, match='already a binary'):
+        Field.ConvertToBinary(binary, str(tmpdir.join('again.bin')))
+    with pytest.raises(ValueError, match='not a binary'):
+        Field.ConvertToText(text, str(tmpdir.join('again.dat')))
+
+
+def test_binary_size_mismatch(tmpdir):
+    field = Field.Field2D(_Values(6*7*5, 2).reshape(6,7,5))
+    path  = str(tmpdir.join('field.bin'))
+    with np.errstate(over='ignore'):
+        field.Write(path, binary=True)
+    raw = open(path, 'rb').read()
+
+    open(path, 'wb').write(raw[:-4])
+    with pytest.raises(ValueError, match='binary field map has 209 values'):
+        Field.Load(path)
+    open(path, 'wb').write(raw + b'\0'*4)
+    with pytest.raises(ValueError, match='binary field map has 211 values'):
+        Field.Load(path)
+    open(path, 'wb').write(raw.replace(b'binary> 4', b'binary> 2'))
+    with pytest.raises(ValueError, match='must be 4 or 8 bytes'):
+        Field.Load(path)
+
+
+def _TarGz(source, path):
+    tar = tarfile.open(path, 'w:gz')
+    tar.add(source, arcname='field.dat')
+    tar.close()
+
+
+def test_load_text_and_tar_gz(tmpdir, monkeypatch):
+    monkeypatch.setattr(_Loader, '_BLOCKSIZE', 1000) # many blocks, split mid number
+    for i,field in enumerate(_Fields(True)):
+        path = str(tmpdir.join('field%d.dat' % i))
+        field.Write(path)
+        _TarGz(path, path + '.tar.gz')
+        rows   = field._Rows()
+        loaded = Field.Load(path)
+        assert loaded.shape[-1] == rows.shape[-1]
+        assert np.array_equal(loaded.reshape(rows.shape), rows, equal_nan=True)
+        assert np.array_equal(Field.Load(path + '.tar.gz'), loaded, equal_nan=True)
+
+
+def test_load_non_ascii_header(tmpdir):
+    field = Field.Field1D(_Values(10*4).reshape(10,4), doublePrecision=True)
+    path  = str(tmpdir.join('field.dat'))
+    field.Write(path)
+    text = open(path, 'rb').read()
+    for comment in [u'# mesur\xe9 \xe0 20\xb0C\n'.encode('latin-1'), u'# ΔB ≤ 1%\n'.encode('utf-8')]:
+        open(path, 'wb').write(comment + text)
+        assert np.array_equal(Field.Load(path).reshape(10,4), field.data, equal_nan=True)
+        binary = str(tmpdir.join('field.bin'))
+        Field.ConvertToBinary(path, binary)
+        assert open(binary, 'rb').read().startswith(comment + text.split(b'!')[0])
+        assert np.array_equal(Field.Load(binary).reshape(10,4), field.data, equal_nan=True)
+
+
+def test_load_value_count_mismatch(tmpdir):
+    field = Field.Field2D(_Values(6*7*5, 2).reshape(6,7,5))
+    path  = str(tmpdir.join('field.dat'))
+    field.Write(path)
+    text = open(path).read()
+
+    open(path, 'w').write(text + '1.0 2.0\n')
+    with pytest.raises(ValueError, match='more values in field map'):
+        Field.Load(path)
+    _TarGz(path, path + '.tar.gz')
+    with pytest.raises(ValueError, match='more values in field map'):
+        Field.Load(path + '.tar.gz')
+
+    open(path, 'w').write(text.rsplit('\n', 2)[0] + '\n')
+    with pytest.raises(ValueError, match='field map has 205 values but .* give 210'):
+        Field.Load(path)
+
+
+def _Map(function, nx=5, ny=4, nz=6):
+    # 3D map (nz,ny,nx,[X,Y,Z,Fx,Fy,Fz]) of the components function(x,y,z)
+    x, y, z = np.linspace(-2, 2, nx), np.linspace(0, 1.5, ny), np.linspace(-3, 2, nz)
+    zz, yy, xx = np.meshgrid(z, y, x, indexing='ij')
+    return np.stack([xx, yy, zz] + list(function(xx, yy, zz)), axis=-1)
+
+
+def _Points(n, seed=1):
+    rng = np.random.RandomState(seed)
+    return np.stack([rng.uniform(-2, 2, n), rng.uniform(0, 1.5, n), rng.uniform(-3, 2, n)], axis=-1)
+
+
+def _Trilinear(x, y, z):
+    return [1 + 2*x - y + 0.5*z, x*y*z - 3*x*z, 0*x + 4.0]
+
+
+def _Linear(x, y, z):
+    return [1 + 2*x - y + 0.5*z, -3*x + 0.25*y, 0*x + 4.0]
+
+
+def _Quadratic(x, y, z):
+    return [x**2 + y*z - 2*z**2]
+
+
+def test_interpolator_linear_reproduces_trilinear_field():
+    points = _Points(1000)
+    fi     = Field.Interpolator(_Map(_Trilinear), batchsize=300)
+    assert np.allclose(fi(points), np.stack(_Trilinear(*points.T), axis=-1))
+    assert np.allclose(fi(points[0]), np.array(_Trilinear(*points[0])))
+    array = _Map(_Trilinear)
+    assert np.allclose(fi(array[..., :3].reshape(-1, 3)), array[..., 3:].reshape(-1, 3))
+
+
+def test_interpolator_cubic_edges():
+    # the points beyond the grid edges are extrapolated linearly, so a linear
+    # field is reproduced in the edge cells as well as inside
+    points = _Points(1000, 2)
+    fi     = Field.Interpolator(_Map(_Linear), method='cubic')
+    assert np.allclose(fi(points), np.stack(_Linear(*points.T), axis=-1))
+    edges  = np.array([[-1.9, 0.1, -2.9], [1.95, 1.45, 1.9], [-2, 0, -3], [2, 1.5, 2]])
+    assert np.allclose(fi(edges), np.stack(_Linear(*edges.T), axis=-1))
+
+    # Catmull-Rom reproduces a quadratic away from the edges and passes
+    # through the grid points everywhere
+    array = _Map(_Quadratic, 9, 9, 9)
+    fi    = Field.Interpolator(array, method='cubic')
+    u     = np.random.RandomState(3).uniform(1, 7, (200, 3)) # not in the first or last cell
+    inner = np.array([-2, 0, -3]) + u*np.array([4, 1.5, 5])/8.0
+    assert np.allclose(fi(inner)[:,0], _Quadratic(*inner.T)[0])
+    assert np.allclose(fi(array[..., :3].reshape(-1, 3)), array[..., 3:].reshape(-1, 1))
+
+
+def test_interpolator_outside():
+    array   = _Map(_Linear)
+    points  = np.array([[0.5, 0.5, 0.5], [2.5, 0.5, 0.5], [0.5, -0.1, 0.5], [0.5, 0.5, np.nan]])
+    inside  = np.array(_Linear(0.5, 0.5, 0.5))
+    for method in ['linear', 'cubic']:
+        result = Field.Interpolator(array, method).Evaluate(points)
+        assert np.allclose(result[0], inside)
+        assert np.all(result[1:] == 0)
+
+        result = Field.Interpolator(array, method, outside='nan')(points)
+        assert np.allclose(result[0], inside)
+        assert np.all(np.isnan(result[1:]))
+
+        result = Field.Interpolator(array, method, outside='clip')(points[:3])
+        edges  = np.array([[2, 0.5, 0.5], [0.5, 0, 0.5]])
+        assert np.allclose(result[0], inside)
+        assert np.allclose(result[1:], np.stack(_Linear(*edges.T), axis=-1))
+
+        fi = Field.Interpolator(array, method, outside='raise')
+        assert np.allclose(fi(points[0]), inside)
+        with pytest.raises(ValueError, match='3 points are outside'):
+            fi(points)
+
+    with pytest.raises(ValueError, match='outside must be'):
+        Field.Interpolator(array, outside='extrapolate')
+    with pytest.raises(ValueError, match='method must be'):
+        Field.Interpolator(array, method='quintic')